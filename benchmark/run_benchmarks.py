@@ -0,0 +1,245 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from config import PROJECT_ROOT, BENCHMARK_BASELINE_PATH, BENCHMARK_OUTPUT_PATH, IMPORT_TIME_BUDGET_MS
+from dataset_generation.generate_products import categories, price_ranges
+
+# Synthetic dataset sizes: (customers, products, purchases)
+SCALES = {
+    "small": (500, 80, 5_000),
+    "medium": (5_000, 500, 50_000),
+    "large": (50_000, 2_000, 500_000),
+}
+
+# Pipeline stages as cli.py arguments, with the unit used to report throughput
+STAGES = [
+    ("generate", ["generate", "-nc", "{customers}"], "purchases"),
+    ("analyze", ["analyze"], "purchases"),
+    ("build-cube", ["build-cube"], "purchases"),
+    ("analyze-window", ["analyze", "-g", "week"], "purchases"),
+    ("clustering-prepare", ["clustering", "prepare"], "purchases"),
+    ("clustering-elbow", ["clustering", "elbow-method"], "customers"),
+    ("clustering-kmeans", ["clustering", "kmeans"], "customers"),
+    ("check-density", ["recommendation", "check-density"], "purchases"),
+    ("build-popularity", ["recommendation", "build-popularity"], "purchases"),
+    ("index-customers", ["recommendation", "index-customers"], "purchases"),
+    ("recommendation-prepare", ["recommendation", "prepare", "-m", "nlp"], "products"),
+    ("precompute-candidates", ["recommendation", "precompute-candidates"], "purchases"),
+    ("content-filter", ["recommendation", "content-filter", "-cid", "C1", "-nca"], "customers"),
+    ("content-filter-all", ["recommendation", "content-filter-all"], "customers"),
+    # Map-reduce jobs over the purchase log partitioned by customer, to compare with their single-process stages
+    ("repartition", ["repartition", "-n", "8"], "purchases"),
+    ("clustering-prepare-partitioned", ["clustering", "prepare", "-pt", "-w", "4"], "purchases"),
+    ("check-density-partitioned", ["recommendation", "check-density", "-pt", "-w", "4"], "purchases"),
+    ("content-filter-all-partitioned", ["recommendation", "content-filter-all", "-pt", "-w", "4"],
+     "customers"),
+]
+
+# Modules the single-customer recommendation path must not import
+HEAVY_MODULES = ["pandas", "scipy", "sklearn", "matplotlib", "torch", "sentence_transformers"]
+
+# Imports the modules of the single-customer recommendation path in a fresh interpreter,
+# then prints the import time and the heavy modules loaded on the way
+IMPORT_CHECK = """
+import json, sys, time
+start = time.perf_counter()
+import cli
+import recommendation.content_based_filtering
+elapsed = time.perf_counter() - start
+print(json.dumps({"import_ms": elapsed * 1000, "heavy_modules": [m for m in %r if m in sys.modules]}))
+"""
+
+
+def synthesize(workspace, num_customers, num_products, num_purchases, seed=42):
+    """
+    Writes a synthetic products list and purchase log of the given size into workspace/data.
+    Products beyond the predefined catalog are numbered variants of it.
+    """
+    rng = np.random.default_rng(seed)
+    catalog = [(description, category) for category, items in categories.items() for description in items]
+    products = pd.DataFrame({
+        "ProductID": [f"P{i + 1}" for i in range(num_products)],
+        "ProductDescription": [
+            catalog[i % len(catalog)][0] + (f" {i // len(catalog) + 1}" if i >= len(catalog) else "")
+            for i in range(num_products)
+        ],
+        "ProductCategory": [catalog[i % len(catalog)][1] for i in range(num_products)],
+    })
+
+    product_idx = rng.integers(0, num_products, num_purchases)
+    low, high = np.array([price_ranges[c] for c in products["ProductCategory"]]).T
+    purchases = pd.DataFrame({
+        "PurchaseID": [f"PU{i + 1:07d}" for i in range(num_purchases)],
+        "CustomerID": [f"C{i + 1}" for i in rng.integers(0, num_customers, num_purchases)],
+        "ProductID": products["ProductID"].to_numpy()[product_idx],
+        "ProductDescription": products["ProductDescription"].to_numpy()[product_idx],
+        "ProductCategory": products["ProductCategory"].to_numpy()[product_idx],
+        "PurchaseAmount": rng.uniform(low[product_idx], high[product_idx]).round(2),
+        "PurchaseDate": pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 366, num_purchases), unit="D"),
+    })
+    purchases["PurchaseDate"] = purchases["PurchaseDate"].dt.strftime("%Y-%m-%d")
+
+    data_path = Path(workspace) / "data"
+    data_path.mkdir(parents=True, exist_ok=True)
+    products.to_csv(data_path / "products.csv", index=False)
+    purchases.to_csv(data_path / "dataset.csv", index=False)
+    return purchases["CustomerID"].nunique()
+
+
+def run_stage(args, workspace, log_file):
+    """
+    Runs one cli.py command in a child process.
+    Returns the wall time, CPU time and peak RSS (MB) of the child, and its exit code.
+    """
+    env = dict(os.environ, RECOMMENDER_WORKSPACE=str(workspace), RECOMMENDER_EMBEDDING_MODEL="local-hashing",
+               MPLBACKEND="Agg")
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, str(PROJECT_ROOT / "cli.py"), *args], cwd=PROJECT_ROOT, env=env,
+                               stdout=log_file, stderr=subprocess.STDOUT)
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    peak_rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return wall, usage.ru_utime + usage.ru_stime, peak_rss_mb, process.returncode
+
+
+def run_scale(scale, workspace, log_path):
+    """
+    Benchmarks every pipeline stage on a synthetic dataset of the given scale.
+    """
+    num_customers, num_products, num_purchases = SCALES[scale]
+    counts = {"customers": num_customers, "products": num_products, "purchases": num_purchases}
+    results = []
+    with open(log_path, "a") as log_file:
+        for stage, args, unit in STAGES:
+            args = [arg.format(**counts) for arg in args]
+            wall, cpu, peak_rss_mb, returncode = run_stage(args, workspace, log_file)
+            if stage == "generate":
+                # The generator decides its own number of purchases. Benchmark the other stages on exact sizes.
+                rows = len(pd.read_csv(Path(workspace) / "data/dataset.csv", usecols=["PurchaseID"]))
+                counts["customers"] = synthesize(workspace, num_customers, num_products, num_purchases)
+            else:
+                rows = 1 if stage == "content-filter" else counts[unit]
+            results.append({
+                "scale": scale,
+                "stage": stage,
+                "wall_s": round(wall, 4),
+                "cpu_s": round(cpu, 4),
+                "peak_rss_mb": round(peak_rss_mb, 1),
+                "rows": rows,
+                "unit": unit,
+                "throughput": round(rows / wall, 1),
+                "returncode": returncode,
+            })
+            print(f"{scale:>8} {stage:<24} {wall:9.3f}s {peak_rss_mb:9.1f}MB {rows / wall:12.1f} {unit}/s"
+                  + ("" if returncode == 0 else f"  (exit code {returncode})"))
+    return results
+
+
+def check_import_budget(budget_ms=IMPORT_TIME_BUDGET_MS, repeats=5):
+    """
+    Measures the cold import time of the single-customer recommendation path in fresh interpreters
+    (best of repeats) and lists the heavy modules it loads. Both must stay within budget for fast CLI start.
+    """
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    measurements = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", IMPORT_CHECK % HEAVY_MODULES], cwd=PROJECT_ROOT, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        measurements.append(json.loads(output.strip().splitlines()[-1]))
+    best = min(measurements, key=lambda m: m["import_ms"])
+    return {
+        "import_ms": round(best["import_ms"], 2),
+        "budget_ms": budget_ms,
+        "heavy_modules": best["heavy_modules"],
+        "within_budget": best["import_ms"] <= budget_ms and not best["heavy_modules"],
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compares wall times against a baseline report.
+    Returns the stages slower than the baseline by more than the tolerance (a fraction, e.g. 0.2 for 20%).
+    """
+    baseline_wall = {(r["scale"], r["stage"]): r["wall_s"] for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        reference = baseline_wall.get((r["scale"], r["stage"]))
+        if not reference:
+            continue
+        ratio = r["wall_s"] / reference
+        r["baseline_ratio"] = round(ratio, 3)
+        if ratio > 1 + tolerance:
+            regressions.append(r)
+    return regressions
+
+
+def run(scales=("small",), output_path=None, baseline_path=BENCHMARK_BASELINE_PATH, tolerance=0.2,
+        save_baseline=False, keep_workspace=False):
+    """
+    Runs the benchmark suite at the given scales and writes a JSON report,
+    by default to a timestamped file in BENCHMARK_OUTPUT_PATH.
+    """
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": [],
+    }
+    for scale in scales:
+        workspace = tempfile.mkdtemp(prefix=f"benchmark_{scale}_")
+        log_path = Path(workspace).parent / f"{Path(workspace).name}.log"
+        print(f"Benchmarking scale '{scale}' (stage output is logged to {log_path})...")
+        try:
+            report["results"] += run_scale(scale, workspace, log_path)
+        finally:
+            if keep_workspace:
+                print(f"Benchmark workspace kept at {workspace}")
+            else:
+                shutil.rmtree(workspace)
+
+    report["import_budget"] = check_import_budget()
+    budget = report["import_budget"]
+    print(f">>> Single-customer import time: {budget['import_ms']:.1f}ms (budget {budget['budget_ms']}ms)"
+          + (f", heavy modules imported: {', '.join(budget['heavy_modules'])}" if budget["heavy_modules"] else ""))
+
+    if baseline_path and os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            regressions = compare(report["results"], json.load(f), tolerance)
+        report["regressions"] = [f"{r['scale']}/{r['stage']}" for r in regressions]
+        if not budget["within_budget"]:
+            report["regressions"].append("import_budget")
+            print(">>> Regression: the single-customer recommendation path exceeds its import budget")
+        for r in regressions:
+            print(f">>> Regression: {r['scale']}/{r['stage']} took {r['baseline_ratio']:.2f}x the baseline wall time")
+        if not report["regressions"]:
+            print(f">>> No stage is slower than the baseline by more than {tolerance:.0%}")
+
+    if output_path is None:
+        os.makedirs(BENCHMARK_OUTPUT_PATH, exist_ok=True)
+        output_path = BENCHMARK_OUTPUT_PATH / f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f">>> Benchmark report saved at {output_path}")
+    if save_baseline:
+        with open(BENCHMARK_BASELINE_PATH, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f">>> Benchmark baseline saved at {BENCHMARK_BASELINE_PATH}")
+    return report
+
+
+if __name__ == "__main__":
+    run()
@@ -3,13 +3,19 @@ import logging
 import shutil
 import os
 
+import profiling
 from config import DATASET_PATH, PRODUCTS_PATH, DEFAULT_NUM_PRODUCTS, DEFAULT_NUM_CUSTOMERS, \
-    DEFAULT_NUM_CLUSTERS, DEFAULT_NUM_CATEGORY, DEFAULT_NUM_PRODUCT
+    DEFAULT_NUM_CLUSTERS, DEFAULT_NUM_CATEGORY, DEFAULT_NUM_PRODUCT, DEFAULT_VIS_MODE, DEFAULT_VIS_MAX_POINTS, \
+    DEFAULT_NUM_CANDIDATES, DEFAULT_HALF_LIFE_DAYS, BENCHMARK_BASELINE_PATH, DEFAULT_NUM_JOBS, DEFAULT_PRECISION, \
+    DEFAULT_EMBEDDING_BATCH_SIZE, DEFAULT_EMBEDDING_WORKERS, DEFAULT_OUTPUT_FORMAT, DEFAULT_HOLDOUT_FRACTION, \
+    DEFAULT_EVALUATION_CONFIGS, DEFAULT_GRANULARITY, CUBE_SKETCH_PRECISION, DEFAULT_NUM_PARTITIONS, \
+    DEFAULT_PARTITION_WORKERS
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 
-def generate_data(product_path, num_products, num_customers):
+@profiling.profile_stage("generate")
+def generate_data(product_path, num_products, num_customers, num_partitions=None):
     logging.info("Starting data generation...")
     from dataset_generation.generate_products import generate_products
     from dataset_generation.generator import generate
@@ -18,24 +24,47 @@ def generate_data(product_path, num_products, num_customers):
         logging.info("Product file not found. Generating products...")
         generate_products(num_products)
 
-    generate(product_path=product_path, num_customers=num_customers)
+    generate(product_path=product_path, num_customers=num_customers, num_partitions=num_partitions)
     logging.info("Data generation completed.")
 
 
-def perform_data_analysis():
+@profiling.profile_stage("repartition")
+def repartition_data(num_partitions):
+    logging.info(f"Partitioning purchase log into {num_partitions} files by CustomerID hash...")
+    from partitions import run as repartition
+    repartition(num_partitions)
+    logging.info("Repartitioning completed.")
+
+
+@profiling.profile_stage("analyze")
+def perform_data_analysis(date_from=None, date_to=None, granularity=None):
     logging.info("Starting data analysis...")
-    from data_analysis import analysis
-    analysis()
+    if date_from or date_to or granularity:
+        from data_analysis import window_analysis
+        window_analysis(date_from, date_to, granularity or DEFAULT_GRANULARITY)
+    else:
+        from data_analysis import analysis
+        analysis()
     logging.info("Data analysis completed.")
 
 
-def prepare_clustering_data():
+@profiling.profile_stage("build-cube")
+def build_sales_cube(precision=CUBE_SKETCH_PRECISION):
+    logging.info("Building the daily sales cube...")
+    from sales_cube import run as sales_cube
+    sales_cube(precision)
+    logging.info("Sales cube completed.")
+
+
+@profiling.profile_stage("clustering-prepare")
+def prepare_clustering_data(partitioned=False, workers=DEFAULT_PARTITION_WORKERS):
     logging.info("Starting data preparation for clustering...")
     from clustering.data_preparation import run as clst_data_preparation
-    clst_data_preparation()
+    clst_data_preparation(partitioned, workers)
     logging.info("Data preparation for clustering completed.")
 
 
+@profiling.profile_stage("clustering-elbow")
 def perform_elbow_check():
     logging.info("Starting elbow check for clustering...")
     from clustering.elbow_check import run as elbow_check
@@ -43,41 +72,97 @@ def perform_elbow_check():
     logging.info("Elbow check completed.")
 
 
-def perform_k_means_clustering(num_clusters):
-    logging.info(f"Starting k-means clustering...")
+@profiling.profile_stage("clustering-kmeans")
+def perform_k_means_clustering(num_clusters, vis_mode=DEFAULT_VIS_MODE, vis_max_points=DEFAULT_VIS_MAX_POINTS):
+    logging.info("Starting k-means clustering...")
     from clustering.k_means_cluster import run as k_means_cluster
-    k_means_cluster(num_clusters)
+    k_means_cluster(num_clusters, vis_mode=vis_mode, vis_max_points=vis_max_points)
     logging.info("K-means clustering completed.")
 
 
-def perform_density_check():
+@profiling.profile_stage("check-density")
+def perform_density_check(partitioned=False, workers=DEFAULT_PARTITION_WORKERS):
     logging.info("Checking density of the interaction matrix...")
     from recommendation.density_check import run as density_check
-    density_check()
+    density_check(partitioned, workers)
     logging.info("Density check completed.")
 
 
-def prepare_recommendation_data(method):
+@profiling.profile_stage("recommendation-prepare")
+def prepare_recommendation_data(method, precision=DEFAULT_PRECISION, batch_size=DEFAULT_EMBEDDING_BATCH_SIZE,
+                                num_workers=DEFAULT_EMBEDDING_WORKERS, top_k=None):
     logging.info(f"Preparing recommendation data using method '{method}'...")
     from recommendation.data_preprocess import run as rec_data_preprocessing
-    rec_data_preprocessing(method)
+    rec_data_preprocessing(method, precision, batch_size, num_workers, top_k)
     logging.info("Recommendation data preparation completed.")
 
 
-def perform_content_based_recommendation(cid, num_category, num_product):
+@profiling.profile_stage("build-popularity")
+def build_popularity(half_life_days, by_month):
+    logging.info("Building time-decayed popularity table...")
+    from recommendation.popularity import run as popularity
+    popularity(half_life_days, by_month)
+    logging.info("Popularity table completed.")
+
+
+@profiling.profile_stage("index-customers")
+def index_customers():
+    logging.info("Indexing purchase log by customer...")
+    from recommendation.customer_index import run as customer_index
+    customer_index()
+    logging.info("Customer indexing completed.")
+
+
+@profiling.profile_stage("ingest")
+def ingest_purchases(purchases_path):
+    logging.info(f"Ingesting purchases from {purchases_path}...")
+    from recommendation.ingest import run as ingest
+    ingest(purchases_path)
+    logging.info("Ingestion completed.")
+
+
+@profiling.profile_stage("precompute-candidates")
+def precompute_candidates(num_candidates):
+    logging.info("Precomputing recommendation candidates per cluster and category...")
+    from recommendation.candidates import run as candidates
+    candidates(num_candidates)
+    logging.info("Candidate precomputation completed.")
+
+
+@profiling.profile_stage("content-filter")
+def perform_content_based_recommendation(cid, num_category, num_product, use_candidates=False, use_cache=True):
     logging.info(f"Getting recommendation for customer {cid}...")
     from recommendation.content_based_filtering import run as content_filtering
-    content_filtering(customer_id=cid, top_categories=num_category, top_n=num_product)
+    content_filtering(customer_id=cid, top_categories=num_category, top_n=num_product, use_candidates=use_candidates,
+                      use_cache=use_cache)
     logging.info("Recommendation completed.")
 
 
-def perform_content_based_recommendation_all():
-    logging.info(f"Getting recommendation for all customers...")
+@profiling.profile_stage("content-filter-all")
+def perform_content_based_recommendation_all(use_candidates=False, use_cache=False, output_format=DEFAULT_OUTPUT_FORMAT,
+                                             long_format=False, partitioned=False, workers=DEFAULT_PARTITION_WORKERS):
+    logging.info("Getting recommendation for all customers...")
     from recommendation.content_based_filtering import run_all as content_filtering_all
-    content_filtering_all()
+    content_filtering_all(use_candidates=use_candidates, use_cache=use_cache, output_format=output_format,
+                          long_format=long_format, partitioned=partitioned, workers=workers)
     logging.info("Recommendation completed.")
 
 
+@profiling.profile_stage("evaluate")
+def perform_evaluation(configs, holdout_fraction, k, num_category, num_product, num_candidates):
+    logging.info(f"Evaluating recommender configurations {', '.join(configs)}...")
+    from recommendation.evaluation import run as evaluation
+    evaluation(configs, holdout_fraction, k, num_category, num_product, num_candidates)
+    logging.info("Evaluation completed.")
+
+
+def perform_benchmark(scales, output_path, baseline_path, tolerance, save_baseline, keep_workspace):
+    logging.info(f"Benchmarking pipeline stages at scales {', '.join(scales)}...")
+    from benchmark.run_benchmarks import run as benchmark
+    benchmark(scales, output_path, baseline_path, tolerance, save_baseline, keep_workspace)
+    logging.info("Benchmark completed.")
+
+
 def clear_all():
     """
     Clear all data, results and intermediate data.
@@ -103,36 +188,102 @@ def clear_all():
             logging.warning(f"Path does not exist: {path}")
 
 
-def run_all(overwrite_data):
+def pipeline_stages():
+    """
+    The run-all pipeline stages with the files they read and write.
+    Stages that do not read each other's outputs can run concurrently.
+    """
+    from config import ANALYSIS_OUTPUT_PATH, OUTPUT_PATH, CLUSTER_OUTPUT_PATH, CLUSTER_TEMP_PATH, \
+        RECOMMENDATION_TEMP_PATH, REC_OUTPUT_PATH, EMBEDDING_MODEL, CUBE_MANIFEST_PATH
+    from pipeline import Stage
+    scaled_features = CLUSTER_TEMP_PATH / "scaled_features.csv"
+    clustered_data = CLUSTER_OUTPUT_PATH / "clustered_data.csv"
+    similarity_artifacts = [
+        RECOMMENDATION_TEMP_PATH / name
+        for name in ("similarity_matrix.pkl", "similarity_scales.pkl", "pid_to_smid.pkl", "similarity_products.npy",
+                     "product_metadata.csv")
+    ]
+    popularity = RECOMMENDATION_TEMP_PATH / "popularity.pkl"
+    customer_index = [RECOMMENDATION_TEMP_PATH / "dataset_by_customer.csv",
+                      RECOMMENDATION_TEMP_PATH / "customer_index.npz",
+                      RECOMMENDATION_TEMP_PATH / "indexed_customers.npy"]
+    candidates = RECOMMENDATION_TEMP_PATH / "candidates.pkl"
+
+    return [
+        Stage("analyze", perform_data_analysis,
+              inputs=[DATASET_PATH], outputs=[ANALYSIS_OUTPUT_PATH, OUTPUT_PATH / "Monthly_Sales_Amount.png"]),
+        Stage("build-cube", build_sales_cube, inputs=[DATASET_PATH], outputs=[CUBE_MANIFEST_PATH]),
+        Stage("clustering-prepare", prepare_clustering_data,
+              inputs=[DATASET_PATH], outputs=[scaled_features]),
+        Stage("clustering-elbow", perform_elbow_check,
+              inputs=[scaled_features], outputs=[CLUSTER_OUTPUT_PATH / "elbow_plot_kmeans.png"]),
+        Stage("clustering-kmeans", perform_k_means_clustering, args=[DEFAULT_NUM_CLUSTERS],
+              inputs=[scaled_features], params={"num_clusters": DEFAULT_NUM_CLUSTERS},
+              outputs=[clustered_data, CLUSTER_OUTPUT_PATH / "cluster_centroids.txt",
+                       CLUSTER_OUTPUT_PATH / "k_means_visualization.html",
+                       CLUSTER_OUTPUT_PATH / "silhouette_score.png"]),
+        Stage("check-density", perform_density_check, inputs=[DATASET_PATH]),
+        Stage("build-popularity", build_popularity, args=[DEFAULT_HALF_LIFE_DAYS, False],
+              inputs=[DATASET_PATH], params={"half_life_days": DEFAULT_HALF_LIFE_DAYS}, outputs=[popularity]),
+        Stage("index-customers", index_customers, inputs=[DATASET_PATH], outputs=customer_index),
+        Stage("recommendation-prepare", prepare_recommendation_data, args=["nlp", DEFAULT_PRECISION],
+              inputs=[PRODUCTS_PATH], outputs=similarity_artifacts,
+              params={"method": "nlp", "model": EMBEDDING_MODEL, "precision": DEFAULT_PRECISION},
+              threads=os.cpu_count()),  # The embedding model benefits the most from extra threads
+        Stage("precompute-candidates", precompute_candidates, args=[DEFAULT_NUM_CANDIDATES],
+              inputs=[DATASET_PATH, clustered_data], params={"num_candidates": DEFAULT_NUM_CANDIDATES},
+              outputs=[candidates]),
+        Stage("content-filter", perform_content_based_recommendation,
+              args=["C001", DEFAULT_NUM_CATEGORY, DEFAULT_NUM_PRODUCT],
+              inputs=[DATASET_PATH, PRODUCTS_PATH, *similarity_artifacts, popularity, *customer_index, candidates],
+              params={"customer_id": "C001", "num_category": DEFAULT_NUM_CATEGORY, "num_product": DEFAULT_NUM_PRODUCT},
+              outputs=[REC_OUTPUT_PATH / "C001.csv"]),
+    ]
+
+
+def run_all(overwrite_data, force=False, jobs=DEFAULT_NUM_JOBS):
     """
     Run data generation, clustering, elbow check, k-means clustering, density check and recommendation
     using default config.
+    Stages whose inputs and parameters are unchanged since their last run are skipped unless force is set.
+    With jobs > 1, independent stages run concurrently in worker processes.
     """
+    from pipeline import run_pipeline
     try:
         if not os.path.exists(DATASET_PATH) or not overwrite_data:
             generate_data(PRODUCTS_PATH, DEFAULT_NUM_PRODUCTS, DEFAULT_NUM_CUSTOMERS)
-        perform_data_analysis()
-        prepare_clustering_data()
-        perform_elbow_check()
-        perform_k_means_clustering(DEFAULT_NUM_CLUSTERS)
-        perform_density_check()
-        prepare_recommendation_data("nlp")
-        perform_content_based_recommendation("C001", DEFAULT_NUM_CATEGORY, DEFAULT_NUM_PRODUCT)
+        run_pipeline(pipeline_stages(), force=force, jobs=jobs)
     except Exception as e:
         logging.error(f"An error occurred: {e}", exc_info=True)
 
 
+def add_partition_arguments(parser):
+    parser.add_argument("-pt", "--partitioned", action="store_true",
+                        help="Run as a map-reduce job over the partitions of the purchase log (see repartition)")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_PARTITION_WORKERS,
+                        help=f"Worker processes of the partitioned job (default={DEFAULT_PARTITION_WORKERS})")
+
+
 def main():
     """
     The entry point for this CLI.
     """
     parser = argparse.ArgumentParser(description="Yanmei's Recommendation CLI")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record wall time, CPU time, peak memory and rows processed per stage and step, "
+                             "and write a Chrome trace to PROFILE_OUTPUT_PATH")
+    parser.add_argument("--profile_cprofile", action="store_true",
+                        help="With --profile, also write a cProfile dump per stage")
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
     run_all_parser = subparsers.add_parser("run-all",
                                            help="Run data generation, data analysis, k means clustering and recommendation using default configuration")
     run_all_parser.add_argument("-d", "--overwrite-data", help="Overwrite existing data", action="store_false")
-    clear_all_parser = subparsers.add_parser("clear-all", help="Clear all data & results")
+    run_all_parser.add_argument("-f", "--force", action="store_true",
+                                help="Run every stage, even if its inputs and parameters are unchanged")
+    run_all_parser.add_argument("-j", "--jobs", type=int, default=DEFAULT_NUM_JOBS,
+                                help=f"Number of independent stages to run concurrently (default={DEFAULT_NUM_JOBS})")
+    subparsers.add_parser("clear-all", help="Clear all data & results")
 
     # Subcommand: generate_data
     generate_parser = subparsers.add_parser("generate", help="Generate synthetic data")
@@ -142,19 +293,46 @@ def main():
                                  help=f"Number of products to generate (default={DEFAULT_NUM_PRODUCTS})")
     generate_parser.add_argument("-nc", "--num_customers", type=int, default=DEFAULT_NUM_CUSTOMERS,
                                  help=f"Number of customers to generate (default={DEFAULT_NUM_CUSTOMERS})")
+    generate_parser.add_argument("-npt", "--num_partitions", type=int, default=None,
+                                 help="Also write the purchase log as this many files partitioned by CustomerID hash")
+
+    # Subcommand: repartition
+    repartition_parser = subparsers.add_parser("repartition",
+                                               help="Write the purchase log as files partitioned by CustomerID hash")
+    repartition_parser.add_argument("-n", "--num_partitions", type=int, default=DEFAULT_NUM_PARTITIONS,
+                                    help=f"Number of partitions (default={DEFAULT_NUM_PARTITIONS})")
 
     # Subcommand: data_analysis
-    generate_parser = subparsers.add_parser("analyze", help="Perform data analysis")
+    analysis_parser = subparsers.add_parser("analyze", help="Perform data analysis")
+    analysis_parser.add_argument("-f", "--from", dest="date_from", type=str, default=None,
+                                 help="First day of the analysis window (YYYY-MM-DD), answered from the sales cube")
+    analysis_parser.add_argument("-t", "--to", dest="date_to", type=str, default=None,
+                                 help="Last day of the analysis window (YYYY-MM-DD), answered from the sales cube")
+    analysis_parser.add_argument("-g", "--granularity", type=str, choices=["day", "week", "month", "year"],
+                                 default=None,
+                                 help=f"Period of the windowed sales breakdown (default={DEFAULT_GRANULARITY})")
+    cube_parser = subparsers.add_parser("build-cube",
+                                        help="Pre-aggregate daily sales per category and product, partitioned by month")
+    cube_parser.add_argument("-sp", "--sketch_precision", type=int, default=CUBE_SKETCH_PRECISION,
+                             help=f"Distinct customer sketches have 2^sketch_precision registers (default={CUBE_SKETCH_PRECISION})")
 
     # Subcommand: clustering
     clustering_parser = subparsers.add_parser("clustering", help="Clustering-related commands")
     clustering_subparsers = clustering_parser.add_subparsers(dest="clustering_command", help="Clustering subcommands")
     prepare_data_parser = clustering_subparsers.add_parser("prepare", help="Prepare data for clustering")
-    elbow_check_parser = clustering_subparsers.add_parser("elbow-method",
-                                                          help="Perform Elbow check for suitable number of clusters")
+    add_partition_arguments(prepare_data_parser)
+    clustering_subparsers.add_parser("elbow-method",
+                                     help="Perform Elbow check for suitable number of clusters")
     k_means_cluster_parser = clustering_subparsers.add_parser("kmeans", help="Perform K-means clustering")
     k_means_cluster_parser.add_argument("-c", "--num_clusters", type=int, default=DEFAULT_NUM_CLUSTERS,
                                         help=f"Number of clusters (default={DEFAULT_NUM_CLUSTERS})")
+    k_means_cluster_parser.add_argument("-vm", "--vis_mode", type=str, choices=["full", "sample", "voxel"],
+                                        default=DEFAULT_VIS_MODE,
+                                        help=f"3D plot mode: plot every customer, a stratified sample per cluster, "
+                                             f"or voxel aggregates (default={DEFAULT_VIS_MODE})")
+    k_means_cluster_parser.add_argument("-vp", "--vis_max_points", type=int, default=DEFAULT_VIS_MAX_POINTS,
+                                        help="Maximum number of points in the 3D plot, but at least one per cluster in voxel mode "
+                                             f"(default={DEFAULT_VIS_MAX_POINTS})")
 
     # Subcommand: Recommendation
     recommendation_parser = subparsers.add_parser("recommendation", help="Recommendation-related commands")
@@ -162,11 +340,44 @@ def main():
                                                                     description="Recommendation subcommands")
     density_check_parser = recommendation_subparser.add_parser("check-density",
                                                                help="Perform density check for the interaction matrix")
+    add_partition_arguments(density_check_parser)
     prepare_data_parser = recommendation_subparser.add_parser("prepare", help="Prepare data for recommendation")
     prepare_data_parser.add_argument(
         "-m", "--method", type=str, choices=["nlp", "pairwise"], required=True,
         help="Choose the data preparation method: 'nlp' (recommended for more relavent results) or 'pairwise'."
     )
+    prepare_data_parser.add_argument(
+        "-p", "--precision", type=str, choices=["float64", "float16", "int8"], default=DEFAULT_PRECISION,
+        help=f"Storage precision of the similarity matrix and embeddings (default={DEFAULT_PRECISION})"
+    )
+    prepare_data_parser.add_argument(
+        "-bs", "--batch_size", type=int, default=DEFAULT_EMBEDDING_BATCH_SIZE,
+        help=f"Texts per embedding batch for method 'nlp' (default={DEFAULT_EMBEDDING_BATCH_SIZE})"
+    )
+    prepare_data_parser.add_argument(
+        "-w", "--workers", type=int, default=DEFAULT_EMBEDDING_WORKERS,
+        help=f"Embedding processes for method 'nlp' (default={DEFAULT_EMBEDDING_WORKERS})"
+    )
+    prepare_data_parser.add_argument(
+        "-k", "--top_k", type=int, default=None,
+        help="For method 'pairwise', keep only the top K TF-IDF similarities per product in a sparse matrix"
+    )
+    popularity_parser = recommendation_subparser.add_parser("build-popularity",
+                                                            help="Precompute time-decayed product popularity for new customers")
+    popularity_parser.add_argument("-hl", "--half_life", type=float, default=DEFAULT_HALF_LIFE_DAYS,
+                                   help=f"Half-life of purchase weights in days (default={DEFAULT_HALF_LIFE_DAYS})")
+    popularity_parser.add_argument("-bm", "--by_month", action="store_true",
+                                   help="Also compute popularity per month")
+    recommendation_subparser.add_parser("index-customers",
+                                        help="Sort the purchase log by customer and build its offset index")
+    ingest_parser = recommendation_subparser.add_parser("ingest",
+                                                        help="Append new purchases and refresh precomputed data incrementally")
+    ingest_parser.add_argument("-i", "--input", required=True, type=str,
+                               help="Path to a CSV of new purchase records (same columns as the dataset)")
+    candidates_parser = recommendation_subparser.add_parser("precompute-candidates",
+                                                            help="Precompute top product candidates per cluster and category")
+    candidates_parser.add_argument("-n", "--num_candidates", type=int, default=DEFAULT_NUM_CANDIDATES,
+                                   help=f"Number of candidates per cluster and category (default={DEFAULT_NUM_CANDIDATES})")
     content_based_filtering_parser = recommendation_subparser.add_parser("content-filter",
                                                                          help="Get recommendations using content based filtering")
     content_based_filtering_parser.add_argument("-cid", "--customer_id", required=True, type=str,
@@ -175,42 +386,114 @@ def main():
                                                 help=f"number of categories to recommend (default={DEFAULT_NUM_CATEGORY})")
     content_based_filtering_parser.add_argument("-np", "--num_product", type=int, default=DEFAULT_NUM_PRODUCT,
                                                 help=f"Number of recommended products in each category (default={DEFAULT_NUM_PRODUCT})")
+    content_based_filtering_parser.add_argument("-uc", "--use_candidates", action="store_true",
+                                                help="Only score the precomputed candidates of the customer's cluster and top categories, and the overall best sellers")
+    content_based_filtering_parser.add_argument("-nca", "--no_cache", action="store_true",
+                                                help="Recompute the recommendations instead of serving cached results")
 
     content_based_filtering_all_parser = recommendation_subparser.add_parser("content-filter-all", help="Get recommendations for all customers")
+    content_based_filtering_all_parser.add_argument("-uc", "--use_candidates", action="store_true",
+                                                    help="Only score the precomputed candidates of each customer's cluster and top categories, and the overall best sellers")
+    content_based_filtering_all_parser.add_argument("-uca", "--use_cache", action="store_true",
+                                                    help="Serve and store results in the recommendation cache")
+    content_based_filtering_all_parser.add_argument("-of", "--output_format", type=str, choices=["csv", "parquet"],
+                                                    default=DEFAULT_OUTPUT_FORMAT,
+                                                    help=f"Format of the output file (default={DEFAULT_OUTPUT_FORMAT})")
+    content_based_filtering_all_parser.add_argument("-lf", "--long_format", action="store_true",
+                                                    help="Write one row per recommendation instead of one row per customer")
+    add_partition_arguments(content_based_filtering_all_parser)
+
+    evaluation_parser = recommendation_subparser.add_parser("evaluate",
+                                                            help="Evaluate recommendation quality and speed on a temporal holdout")
+    evaluation_parser.add_argument("-c", "--configs", nargs="+", default=DEFAULT_EVALUATION_CONFIGS,
+                                   help="Recommender configurations: baseline, candidates, precision=<precision>, "
+                                        "top_k=<K>, or combinations joined by '+' "
+                                        f"(default={' '.join(DEFAULT_EVALUATION_CONFIGS)})")
+    evaluation_parser.add_argument("-hf", "--holdout_fraction", type=float, default=DEFAULT_HOLDOUT_FRACTION,
+                                   help=f"Latest fraction of each customer's purchases held out (default={DEFAULT_HOLDOUT_FRACTION})")
+    evaluation_parser.add_argument("-k", "--k", type=int, default=None,
+                                   help="Cutoff of the ranking metrics (default=all recommendations)")
+    evaluation_parser.add_argument("-nc", "--num_category", type=int, default=DEFAULT_NUM_CATEGORY,
+                                   help=f"number of categories to recommend (default={DEFAULT_NUM_CATEGORY})")
+    evaluation_parser.add_argument("-np", "--num_product", type=int, default=DEFAULT_NUM_PRODUCT,
+                                   help=f"Number of recommended products in each category (default={DEFAULT_NUM_PRODUCT})")
+    evaluation_parser.add_argument("-n", "--num_candidates", type=int, default=DEFAULT_NUM_CANDIDATES,
+                                   help=f"Number of candidates per cluster and category (default={DEFAULT_NUM_CANDIDATES})")
+
+    # Subcommand: benchmark
+    benchmark_parser = subparsers.add_parser("benchmark", help="Benchmark every pipeline stage on synthetic datasets")
+    benchmark_parser.add_argument("-s", "--scales", nargs="+", choices=["small", "medium", "large"], default=["small"],
+                                  help="Dataset scales to benchmark (default=small)")
+    benchmark_parser.add_argument("-o", "--output", type=str, default=None,
+                                  help="Path of the JSON benchmark report (default=a timestamped file in results/benchmark)")
+    benchmark_parser.add_argument("-b", "--baseline", type=str, default=BENCHMARK_BASELINE_PATH,
+                                  help=f"Baseline JSON report to compare against (default={BENCHMARK_BASELINE_PATH})")
+    benchmark_parser.add_argument("-t", "--tolerance", type=float, default=0.2,
+                                  help="Allowed wall time increase over the baseline, as a fraction (default=0.2)")
+    benchmark_parser.add_argument("--save_baseline", action="store_true",
+                                  help="Save this run as the new baseline")
+    benchmark_parser.add_argument("--keep_workspace", action="store_true",
+                                  help="Keep the generated benchmark data and results")
 
     args = parser.parse_args()
 
+    if args.profile:
+        profiling.enable(cprofile=args.profile_cprofile)
+
     if args.command is None:
         parser.print_help()
     elif args.command == "run-all":
-        run_all(args.overwrite_data)
+        run_all(args.overwrite_data, args.force, args.jobs)
     elif args.command == "clear-all":
         clear_all()
     elif args.command == "generate":
-        generate_data(args.product_path, args.num_products, args.num_customers)
+        generate_data(args.product_path, args.num_products, args.num_customers, args.num_partitions)
+    elif args.command == "repartition":
+        repartition_data(args.num_partitions)
     elif args.command == "analyze":
-        perform_data_analysis()
+        perform_data_analysis(args.date_from, args.date_to, args.granularity)
+    elif args.command == "build-cube":
+        build_sales_cube(args.sketch_precision)
+    elif args.command == "benchmark":
+        perform_benchmark(args.scales, args.output, args.baseline, args.tolerance, args.save_baseline,
+                          args.keep_workspace)
     elif args.command == "clustering":
         if args.clustering_command == "prepare":
-            prepare_clustering_data()
+            prepare_clustering_data(args.partitioned, args.workers)
         elif args.clustering_command == "elbow-method":
             perform_elbow_check()
         elif args.clustering_command == "kmeans":
-            perform_k_means_clustering(args.num_clusters)
+            perform_k_means_clustering(args.num_clusters, args.vis_mode, args.vis_max_points)
         else:
             clustering_parser.print_help()
     elif args.command == "recommendation":
         if args.recommendation_command == "check-density":
-            perform_density_check()
+            perform_density_check(args.partitioned, args.workers)
         elif args.recommendation_command == "prepare":
-            prepare_recommendation_data(args.method)
+            prepare_recommendation_data(args.method, args.precision, args.batch_size, args.workers, args.top_k)
+        elif args.recommendation_command == "build-popularity":
+            build_popularity(args.half_life, args.by_month)
+        elif args.recommendation_command == "index-customers":
+            index_customers()
+        elif args.recommendation_command == "ingest":
+            ingest_purchases(args.input)
+        elif args.recommendation_command == "precompute-candidates":
+            precompute_candidates(args.num_candidates)
         elif args.recommendation_command == "content-filter":
-            perform_content_based_recommendation(args.customer_id, args.num_category, args.num_product)
+            perform_content_based_recommendation(args.customer_id, args.num_category, args.num_product,
+                                                 args.use_candidates, not args.no_cache)
         elif args.recommendation_command == "content-filter-all":
-            perform_content_based_recommendation_all()
+            perform_content_based_recommendation_all(args.use_candidates, args.use_cache, args.output_format,
+                                                     args.long_format, args.partitioned, args.workers)
+        elif args.recommendation_command == "evaluate":
+            perform_evaluation(args.configs, args.holdout_fraction, args.k, args.num_category, args.num_product,
+                               args.num_candidates)
         else:
             recommendation_parser.print_help()
 
+    if args.profile:
+        profiling.write_trace()
+
 
 if __name__ == "__main__":
     main()
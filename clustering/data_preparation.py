@@ -1,46 +1,163 @@
 import os
+import shutil
+
+import numpy as np
 import pandas as pd
 from sklearn.preprocessing import StandardScaler
 
-from config import DATASET_PATH, CLUSTER_TEMP_PATH
+from config import DATASET_PATH, CLUSTER_TEMP_PATH, DEFAULT_PARTITION_WORKERS
+from registry import load_registry
+from partitions import partition_files, map_partitions, concatenate_csv
+from profiling import profile_step, add_rows
+
+NUMERICAL_COLUMNS = ['TotalSpending', 'PurchaseFrequency', 'Recency']  # RFM features
 
 
-def feature_scaling(df):
+def feature_scaling(df, registry):
     """
     Prepare customer data for clustering by extracting RFM features.
     """
 
-    # Extract RFM features from customers
-    df['PurchaseDate'] = pd.to_datetime(df['PurchaseDate'])
-    customer_data = df.groupby('CustomerID').agg(
+    # Extract RFM features from customers, grouped by customer code
+    with profile_step("date_parsing"):
+        df['PurchaseDate'] = pd.to_datetime(df['PurchaseDate'])
+    customer_data = df.groupby(registry.encode_customers(df['CustomerID'])).agg(
         TotalSpending=('PurchaseAmount', 'sum'),
         PurchaseFrequency=('PurchaseID', 'count'),
         LastPurchase=('PurchaseDate', 'max')
-    ).reset_index()
+    )
+    customer_data.insert(0, 'CustomerID', registry.customer_ids[customer_data.index])
+    customer_data = customer_data.reset_index(drop=True)
 
     # Calculate recency.
     # Baseline is the latest datetime in the PurchaseDate records
     customer_data['Recency'] = (df['PurchaseDate'].max() - customer_data['LastPurchase']).dt.days
 
     # Feature scaling to numerical columns using StandardScaler
-    numerical_columns = ['TotalSpending', 'PurchaseFrequency', 'Recency']  # RFM features
     scaler = StandardScaler()
-    customer_data[numerical_columns] = scaler.fit_transform(customer_data[numerical_columns])
+    customer_data[NUMERICAL_COLUMNS] = scaler.fit_transform(customer_data[NUMERICAL_COLUMNS])
 
     return customer_data
 
 
-def run():
-    try:
-        df = pd.read_csv(DATASET_PATH)
-    except FileNotFoundError as e:
-        raise FileNotFoundError(f"Dataset file not found at {DATASET_PATH}.") from e
+def moments(values):
+    """
+    Count, mean and sum of squared deviations of values, mergeable across partitions.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    mean = values.mean() if len(values) else 0.0
+    return len(values), mean, float(((values - mean) ** 2).sum())
+
+
+def merge_moments(a, b):
+    """
+    Merges the moments of two disjoint sets of values (Chan et al.'s parallel variance).
+    """
+    n = a[0] + b[0]
+    if n == 0:
+        return a
+    delta = b[1] - a[1]
+    return n, a[1] + delta * b[0] / n, a[2] + b[2] + delta ** 2 * a[0] * b[0] / n
+
+
+def rfm_partition(path, output_path):
+    """
+    Map step of the partitioned RFM preparation. Every customer's purchases are in a single partition,
+    so the partition's per-customer aggregates are final. They are saved to output_path, and only the partition's
+    latest purchase date and the moments of each feature are returned for the reduce step.
+    Recency is a shift of the last purchase day, so its moments follow from those of the last purchase day.
+    """
+    df = pd.read_csv(path, usecols=['CustomerID', 'PurchaseID', 'PurchaseAmount', 'PurchaseDate'])
+    df['PurchaseDate'] = pd.to_datetime(df['PurchaseDate'])
+    customer_data = df.groupby('CustomerID').agg(
+        TotalSpending=('PurchaseAmount', 'sum'),
+        PurchaseFrequency=('PurchaseID', 'count'),
+        LastPurchase=('PurchaseDate', 'max')
+    ).reset_index()
+    customer_data.to_pickle(output_path)
 
+    last_days = customer_data['LastPurchase'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    return {
+        "rows": len(df),
+        "max_date": df['PurchaseDate'].max(),
+        "TotalSpending": moments(customer_data['TotalSpending']),
+        "PurchaseFrequency": moments(customer_data['PurchaseFrequency']),
+        "LastPurchase": moments(last_days),
+    }
+
+
+def scale_partition(input_path, output_path, max_date, means, scales):
+    """
+    Second map step: computes the recency of the partition's customers against the global latest purchase date
+    and standardizes the features with the global means and scales.
+    """
+    customer_data = pd.read_pickle(input_path)
+    customer_data['Recency'] = (max_date - customer_data['LastPurchase']).dt.days
+    customer_data[NUMERICAL_COLUMNS] = (customer_data[NUMERICAL_COLUMNS] - means) / scales
+    customer_data.to_csv(output_path, index=False)
+    return len(customer_data)
+
+
+def run_partitioned(paths, workers=DEFAULT_PARTITION_WORKERS):
+    """
+    Prepares the RFM features as a map-reduce job over the partitions of the purchase log.
+    Only the latest purchase date and the feature moments are merged across partitions. Scaling matches
+    StandardScaler on the whole log.
+    """
+    temp_path = CLUSTER_TEMP_PATH / "rfm_partitions"
+    os.makedirs(temp_path, exist_ok=True)
+    raw_paths = [temp_path / f"raw-{i:05d}.pkl" for i in range(len(paths))]
+    scaled_paths = [temp_path / f"scaled-{i:05d}.csv" for i in range(len(paths))]
+
+    with profile_step("map_aggregate"):
+        stats = map_partitions(rfm_partition, list(zip(paths, raw_paths)), workers)
+        add_rows(sum(s["rows"] for s in stats))
+
+    # Reduce: global latest purchase date and feature moments
+    max_date = max(s["max_date"] for s in stats if s["rows"])
+    merged = {}
+    for column in ['TotalSpending', 'PurchaseFrequency', 'LastPurchase']:
+        merged[column] = (0, 0.0, 0.0)
+        for s in stats:
+            merged[column] = merge_moments(merged[column], s[column])
+    max_day = np.datetime64(max_date, 'D').astype(np.int64)
+    means = np.array([merged['TotalSpending'][1], merged['PurchaseFrequency'][1],
+                      max_day - merged['LastPurchase'][1]])
+    variances = np.array([merged[column][2] / merged[column][0]
+                          for column in ['TotalSpending', 'PurchaseFrequency', 'LastPurchase']])
+    scales = np.where(variances > 0, np.sqrt(variances), 1.0)  # Like StandardScaler for constant features
+
+    with profile_step("map_scale"):
+        customers = map_partitions(scale_partition, [(raw, scaled, max_date, means, scales)
+                                                     for raw, scaled in zip(raw_paths, scaled_paths)], workers)
+        add_rows(sum(customers))
+    with profile_step("output_write"):
+        concatenate_csv(scaled_paths, CLUSTER_TEMP_PATH / "scaled_features.csv")
+    shutil.rmtree(temp_path)
+
+
+def run(partitioned=False, workers=DEFAULT_PARTITION_WORKERS):
     if not os.path.exists(CLUSTER_TEMP_PATH):
         os.makedirs(CLUSTER_TEMP_PATH)
 
-    prepared_data = feature_scaling(df)
-    prepared_data.to_csv(CLUSTER_TEMP_PATH / "scaled_features.csv", index=False)
+    if partitioned:
+        paths = partition_files()
+        if paths is None:
+            raise FileNotFoundError("Partitioned dataset not found. Please run 'python3 cli.py repartition'.")
+        run_partitioned(paths, workers)
+        print("Data preparation done!")
+        return
+
+    try:
+        with profile_step("csv_load"):
+            df = pd.read_csv(DATASET_PATH, usecols=['CustomerID', 'PurchaseID', 'PurchaseAmount', 'PurchaseDate'])
+            add_rows(len(df))
+    except FileNotFoundError as e:
+        raise FileNotFoundError(f"Dataset file not found at {DATASET_PATH}.") from e
+
+    prepared_data = feature_scaling(df, load_registry())
+    with profile_step("output_write"):
+        prepared_data.to_csv(CLUSTER_TEMP_PATH / "scaled_features.csv", index=False)
 
     print("Data preparation done!")
 
@@ -5,6 +5,7 @@ import pandas as pd
 from sklearn.cluster import KMeans
 
 from config import CLUSTER_OUTPUT_PATH, CLUSTER_TEMP_PATH
+from profiling import profile_step, add_rows
 
 
 def elbow_method(data):
@@ -13,10 +14,12 @@ def elbow_method(data):
     """
     # Calculate the distortion for 1-9 clusters
     distortions = []
-    for k in range(1, 10):
-        kmeans = KMeans(n_clusters=k, random_state=42)
-        kmeans.fit(data[['TotalSpending', 'PurchaseFrequency', 'Recency']])  # RFM features
-        distortions.append(kmeans.inertia_)
+    with profile_step("elbow_sweep"):
+        for k in range(1, 10):
+            kmeans = KMeans(n_clusters=k, random_state=42)
+            kmeans.fit(data[['TotalSpending', 'PurchaseFrequency', 'Recency']])  # RFM features
+            distortions.append(kmeans.inertia_)
+            add_rows(len(data))
 
     # Plot the results
     plt.figure(figsize=(4, 4))
@@ -29,7 +32,9 @@ def elbow_method(data):
 
 def run():
     try:
-        data = pd.read_csv(CLUSTER_TEMP_PATH / 'scaled_features.csv')
+        with profile_step("csv_load"):
+            data = pd.read_csv(CLUSTER_TEMP_PATH / 'scaled_features.csv')
+            add_rows(len(data))
     except FileNotFoundError:
         print('Please complete data preparation for clustering.')
         return
@@ -7,10 +7,11 @@ from sklearn.metrics import silhouette_score, silhouette_samples
 import matplotlib.pyplot as plt
 import numpy as np
 
-from config import CLUSTER_OUTPUT_PATH, CLUSTER_TEMP_PATH
+from config import CLUSTER_OUTPUT_PATH, CLUSTER_TEMP_PATH, DEFAULT_VIS_MODE, DEFAULT_VIS_MAX_POINTS
+from profiling import profile_step, add_rows
 
 
-def kmeans(data, n_clusters: int = 5):
+def kmeans(data, n_clusters: int = 5, vis_mode=DEFAULT_VIS_MODE, vis_max_points=DEFAULT_VIS_MAX_POINTS):
     """
     Perform k-means clustering on the given dataset.
     Calculate the silhouette score, creates a silhouette plot and an interactive 3D scatter plot.
@@ -20,34 +21,104 @@ def kmeans(data, n_clusters: int = 5):
     feature_data = data[features]
 
     # Apply k-means cluster
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    data['Cluster'] = kmeans.fit_predict(feature_data)
+    with profile_step("kmeans_fit"):
+        kmeans = KMeans(n_clusters=n_clusters, random_state=42)
+        data['Cluster'] = kmeans.fit_predict(feature_data)
+        add_rows(len(feature_data))
     centroids = pd.DataFrame(kmeans.cluster_centers_, columns=features)
 
     with open(CLUSTER_OUTPUT_PATH / 'cluster_centroids.txt', 'w') as f:
         f.write(str(centroids))
     print(">>> Cluster centroids saved at " + str(CLUSTER_OUTPUT_PATH / 'cluster_centroids.csv'))
-    visualization_3d(data, features, centroids)
+    with profile_step("visualization"):
+        visualization_3d(data, features, centroids, mode=vis_mode, max_points=vis_max_points)
 
     # Compute silhouette score
-    score = silhouette_score(feature_data, data['Cluster'])
-    plot_silhouette(feature_data.values, data['Cluster'].values, n_clusters)
+    with profile_step("silhouette"):
+        score = silhouette_score(feature_data, data['Cluster'])
+        plot_silhouette(feature_data.values, data['Cluster'].values, n_clusters)
 
     return data, score
 
 
-def visualization_3d(data, features, centroids=None):
+def stratified_sample(data, max_points, random_state=42):
+    """
+    Downsample customers to at most max_points rows, keeping each cluster's share of the points.
+    Every non-empty cluster keeps at least one point, as long as max_points is not smaller than the number of clusters.
+    """
+    cluster_sizes = data['Cluster'].value_counts()
+    quotas = np.maximum(1, np.floor(cluster_sizes * max_points / len(data))).astype(int)
+    # The minimum of one point per cluster can overshoot the budget by up to the number of clusters,
+    # so take the excess from the largest quotas
+    for _ in range(max(0, quotas.sum() - max_points)):
+        quotas[quotas.idxmax()] -= 1
+    samples = [
+        group.sample(min(quotas[cluster], len(group)), random_state=random_state)
+        for cluster, group in data.groupby('Cluster')
+    ]
+    return pd.concat(samples, ignore_index=True)
+
+
+def voxel_aggregate(data, features, max_points):
+    """
+    Bin customers into 3D voxels per cluster and return one point per occupied voxel.
+    The point is placed at the mean of its customers and carries the customer count.
+    The grid resolution is chosen so that the number of voxels does not exceed max_points. Every cluster
+    gets at least one voxel, so with fewer max_points than clusters there is one voxel per cluster.
+    """
+    n_clusters = data['Cluster'].nunique()
+    budget = max_points / n_clusters
+    # Round the cube root, as e.g. 125 ** (1 / 3) is slightly below 5 in floating point
+    bins = round(budget ** (1 / 3))
+    if bins ** 3 > budget:
+        bins -= 1
+    bins = max(1, bins)
+
+    voxel_keys = ['Cluster']
+    binned = data[features + ['Cluster']].copy()
+    for feature in features:
+        values = binned[feature].to_numpy()
+        low, high = values.min(), values.max()
+        span = high - low if high > low else 1
+        binned[f'{feature}Bin'] = np.clip(((values - low) / span * bins).astype(int), 0, bins - 1)
+        voxel_keys.append(f'{feature}Bin')
+
+    aggregations = {feature: (feature, 'mean') for feature in features}
+    aggregations['Count'] = ('Cluster', 'size')
+    return binned.groupby(voxel_keys).agg(**aggregations).reset_index()
+
+
+def visualization_3d(data, features, centroids=None, mode=DEFAULT_VIS_MODE, max_points=DEFAULT_VIS_MAX_POINTS):
     """
     Create an interactive 3D scatter plot for cluster visualization.
+
+    mode='full' plots every customer. For larger datasets, mode='sample' plots a stratified sample per cluster
+    and mode='voxel' plots voxel aggregates sized by customer count, both bounded by max_points.
+    Centroids are always plotted.
     """
 
+    size = None
+    if mode == 'full' or len(data) <= max_points:
+        plot_data = data
+        title = "Interactive 3D Cluster Visualization"
+    elif mode == 'sample':
+        plot_data = stratified_sample(data, max_points)
+        title = f"Interactive 3D Cluster Visualization ({len(plot_data)} of {len(data)} customers sampled)"
+    elif mode == 'voxel':
+        plot_data = voxel_aggregate(data, features, max_points)
+        size = 'Count'
+        title = f"Interactive 3D Cluster Visualization ({len(data)} customers in {len(plot_data)} voxels)"
+    else:
+        raise ValueError(f"Invalid visualization mode '{mode}'. Valid modes are 'full', 'sample' and 'voxel'")
+
     fig = px.scatter_3d(
-        data,
+        plot_data,
         x=features[0],  # TotalSpending
         y=features[1],  # PurchaseFrequency
         z=features[2],  # Recency
         color='Cluster',
-        title="Interactive 3D Cluster Visualization",
+        size=size,
+        title=title,
         labels={
             features[0]: features[0],
             features[1]: features[1],
@@ -135,9 +206,11 @@ def plot_silhouette(prepared_data, labels, n_clusters):
     print(">>> Silhouette plot saved at " + str(CLUSTER_OUTPUT_PATH / 'silhouette_score.png'))
 
 
-def run(n_clusters=6):
+def run(n_clusters=6, vis_mode=DEFAULT_VIS_MODE, vis_max_points=DEFAULT_VIS_MAX_POINTS):
     try:
-        prepared_data = pd.read_csv(CLUSTER_TEMP_PATH / 'scaled_features.csv')
+        with profile_step("csv_load"):
+            prepared_data = pd.read_csv(CLUSTER_TEMP_PATH / 'scaled_features.csv')
+            add_rows(len(prepared_data))
     except FileNotFoundError:
         print("Error: 'scaled_features.csv' not found. Please complete data preparation.")
         return
@@ -147,8 +220,10 @@ def run(n_clusters=6):
         os.makedirs(CLUSTER_OUTPUT_PATH)
 
     # Apply k-means clustering
-    clustered_data, score = kmeans(prepared_data, n_clusters=n_clusters)
-    clustered_data.to_csv(CLUSTER_OUTPUT_PATH / "clustered_data.csv", index=False)
+    clustered_data, score = kmeans(prepared_data, n_clusters=n_clusters,
+                                   vis_mode=vis_mode, vis_max_points=vis_max_points)
+    with profile_step("output_write"):
+        clustered_data.to_csv(CLUSTER_OUTPUT_PATH / "clustered_data.csv", index=False)
     print(f">>> Clustered data saved at {CLUSTER_OUTPUT_PATH}/clustered_data.csv")
 
     print("K-means clustering finished.")
@@ -1,29 +1,89 @@
+import os
 from pathlib import Path
 
 # Path values
 CONFIG_DIR = Path(__file__).resolve().parent
 PROJECT_ROOT = CONFIG_DIR
+# Data, results and intermediate data live under WORKSPACE_ROOT.
+# Set RECOMMENDER_WORKSPACE to run the pipeline in another directory (e.g. for benchmarks).
+WORKSPACE_ROOT = Path(os.environ.get("RECOMMENDER_WORKSPACE", PROJECT_ROOT))
 
-DATA_PATH = PROJECT_ROOT / "data/"
+DATA_PATH = WORKSPACE_ROOT / "data/"
 DATASET_PATH = DATA_PATH / "dataset.csv"
 PRODUCTS_PATH = DATA_PATH / "products.csv"
+REGISTRY_PATH = DATA_PATH / "registry.npz"  # Integer codes of IDs and strings, rebuilt when the data changes
+PARTITION_PATH = DATA_PATH / "partitions/"  # Purchase log hash-partitioned by CustomerID
+CUBE_PATH = DATA_PATH / "cube/"  # Daily sales cube, one partition per month
+CUBE_MANIFEST_PATH = CUBE_PATH / "manifest.json"
 
-OUTPUT_PATH = PROJECT_ROOT / "results"
-ANALYSIS_OUTPUT_PATH = PROJECT_ROOT / "results/analysis_results.txt"
-CLUSTER_OUTPUT_PATH = PROJECT_ROOT / "results/cluster"
-REC_OUTPUT_PATH = PROJECT_ROOT / "results/recommendations"
+OUTPUT_PATH = WORKSPACE_ROOT / "results"
+ANALYSIS_OUTPUT_PATH = WORKSPACE_ROOT / "results/analysis_results.txt"
+ANALYSIS_WINDOW_OUTPUT_PATH = WORKSPACE_ROOT / "results/analysis_window.txt"
+CLUSTER_OUTPUT_PATH = WORKSPACE_ROOT / "results/cluster"
+REC_OUTPUT_PATH = WORKSPACE_ROOT / "results/recommendations"
+PROFILE_OUTPUT_PATH = WORKSPACE_ROOT / "results/profile"
+PIPELINE_MANIFEST_PATH = WORKSPACE_ROOT / "results/pipeline_manifest.json"
+PIPELINE_LOG_PATH = WORKSPACE_ROOT / "results/logs"
+EVALUATION_OUTPUT_PATH = WORKSPACE_ROOT / "results/evaluation.csv"
+BENCHMARK_OUTPUT_PATH = WORKSPACE_ROOT / "results/benchmark"
 
-RECOMMENDATION_TEMP_PATH = PROJECT_ROOT / "recommendation/temp/"
-CLUSTER_TEMP_PATH = PROJECT_ROOT / "clustering/temp/"
+RECOMMENDATION_TEMP_PATH = WORKSPACE_ROOT / "recommendation/temp/"
+REC_CACHE_PATH = RECOMMENDATION_TEMP_PATH / "recommendation_cache.sqlite"
+CLUSTER_TEMP_PATH = WORKSPACE_ROOT / "clustering/temp/"
+
+BENCHMARK_BASELINE_PATH = PROJECT_ROOT / "benchmark/baseline.json"
+IMPORT_TIME_BUDGET_MS = 100  # Import time budget of the single-customer recommendation path
+
+# Sentence Transformers model for the 'nlp' recommendation data preparation.
+# 'local-hashing' selects a deterministic local stand-in encoder that needs no model download.
+EMBEDDING_MODEL = os.environ.get("RECOMMENDER_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
 
 # Default values for cli arguments
 # generate
 DEFAULT_NUM_PRODUCTS = 80
 DEFAULT_NUM_CUSTOMERS = 500
 
+# analyze
+DEFAULT_GRANULARITY = "month"  # Period of the windowed sales breakdown: day, week, month or year
+CUBE_SKETCH_PRECISION = 10  # HyperLogLog sketches of 2^10 registers, about 3% error on distinct customer counts
+
+# repartition and partitioned (-pt) commands
+DEFAULT_NUM_PARTITIONS = 8
+DEFAULT_PARTITION_CHUNK_SIZE = 100_000  # Purchase records read at once when repartitioning
+DEFAULT_PARTITION_WORKERS = os.cpu_count() or 1  # Processes of the partitioned map-reduce jobs
+
+# run-all
+DEFAULT_NUM_JOBS = 1  # Number of stages run concurrently
+
 # clustering kmeans
 DEFAULT_NUM_CLUSTERS = 6
+DEFAULT_VIS_MODE = "sample"  # 3D plot mode: full, sample or voxel
+DEFAULT_VIS_MAX_POINTS = 5000  # Point budget of the 3D plot (centroids excluded)
+
+# recommendation prepare
+DEFAULT_PRECISION = "float64"  # Storage precision of the similarity matrix and embeddings: float64, float16 or int8
+PRECISION_OVERLAP_K = 10  # k of the neighbour overlap@k reported for reduced precisions
+PRECISION_OVERLAP_TOLERANCE = 0.95  # Minimum neighbour overlap@k before a warning is printed
+DEFAULT_EMBEDDING_BATCH_SIZE = 64  # Texts per encoder batch
+DEFAULT_EMBEDDING_WORKERS = 1  # Encoder processes; 1 encodes in the current process
+SPARSE_SIMILARITY_THRESHOLD = 0.1  # Similarities below this are dropped from sparse top-k similarity matrices
+SPARSE_BLOCK_SIZE = 1024  # Rows multiplied at once when computing sparse top-k similarity matrices
+
+# recommendation build-popularity
+DEFAULT_HALF_LIFE_DAYS = 30  # Half-life of the exponential time decay of purchases
+
+# recommendation precompute-candidates
+DEFAULT_NUM_CANDIDATES = 20  # Candidates kept per cluster, per category and overall
 
 # recommendation content-filter
 DEFAULT_NUM_CATEGORY = 2
 DEFAULT_NUM_PRODUCT = 2
+DEFAULT_CACHE_SIZE = 10000  # Maximum number of cached recommendation results
+DEFAULT_CACHE_TTL = 24 * 60 * 60  # Seconds before a cached recommendation result expires
+
+# recommendation content-filter-all
+DEFAULT_OUTPUT_FORMAT = "csv"  # Format of the bulk recommendation output: csv or parquet
+
+# recommendation evaluate
+DEFAULT_HOLDOUT_FRACTION = 0.2  # Latest fraction of each customer's purchases held out for evaluation
+DEFAULT_EVALUATION_CONFIGS = ["baseline", "candidates", "precision=float16", "precision=int8", "top_k=20"]
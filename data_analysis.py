@@ -1,15 +1,19 @@
 import os
 
-import pandas
-from matplotlib import pyplot as plt
-import pandas as pd
-from config import DATASET_PATH, ANALYSIS_OUTPUT_PATH, OUTPUT_PATH
+import numpy as np
+
+from config import DATASET_PATH, ANALYSIS_OUTPUT_PATH, ANALYSIS_WINDOW_OUTPUT_PATH, OUTPUT_PATH, DEFAULT_GRANULARITY
+from profiling import profile_step, add_rows
 
 
 def analysis():
+    import pandas as pd
+    from matplotlib import pyplot as plt
     print('Loading data...')
     try:
-        df = pd.read_csv(DATASET_PATH)
+        with profile_step("csv_load"):
+            df = pd.read_csv(DATASET_PATH)
+            add_rows(len(df))
     except FileNotFoundError:
         print('Dataset not found.')
         return None
@@ -20,7 +24,8 @@ def analysis():
     print('Starting analysis...')
 
     # Analyze sell amount sum by month
-    df['PurchaseDate'] = pd.to_datetime(df['PurchaseDate'])
+    with profile_step("date_parsing"):
+        df['PurchaseDate'] = pd.to_datetime(df['PurchaseDate'])
     df['Month'] = df['PurchaseDate'].dt.month
     sales_by_month = df.groupby('Month')['PurchaseAmount'].sum() / 1000
     plt.figure(figsize=(7, 4))
@@ -58,5 +63,83 @@ def analysis():
     print("Analysis complete!")
 
 
+def format_table(columns, rows):
+    """
+    Formats rows under right-aligned column headers. Floats are written with two decimals.
+    """
+    cells = [list(columns)] + [[f"{value:.2f}" if isinstance(value, float) else str(value) for value in row]
+                               for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(columns))]
+    return "\n".join(" ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in cells)
+
+
+def top_rows(table, values, num_rows=5):
+    """
+    The num_rows rows of a (labels, amounts, counts, customers) summary table with the largest values.
+    """
+    labels, amounts, counts, customers = table
+    order = np.argsort(-values, kind="stable")[:num_rows]
+    return [(labels[i], float(amounts[i]), int(counts[i])) + (() if customers is None else (int(round(customers[i])),))
+            for i in order]
+
+
+def window_analysis(date_from=None, date_to=None, granularity=DEFAULT_GRANULARITY):
+    """
+    Analyzes the sales of a date window from the pre-aggregated sales cube, reading only the partitions of the
+    months in the window. Distinct customer counts are HyperLogLog estimates.
+    """
+    from sales_cube import load_manifest, cube_is_stale, load_window, summarize
+    try:
+        date_from = None if date_from is None else np.datetime64(date_from, "D")
+        date_to = None if date_to is None else np.datetime64(date_to, "D")
+    except ValueError:
+        print("Invalid date. Dates must be given as YYYY-MM-DD.")
+        return None
+
+    manifest = load_manifest()
+    if manifest is None:
+        print("Sales cube not found. Please build it with 'python3 cli.py build-cube'.")
+        return None
+    if cube_is_stale():
+        print("Warning: the dataset changed since the sales cube was built. Rebuild it with 'python3 cli.py build-cube'.")
+
+    with profile_step("partition_load"):
+        window = load_window(manifest, date_from, date_to)
+        add_rows(0 if window is None else len(window["date"]))
+    if window is None or not len(window["date"]):
+        print("No sales in the given window.")
+        return None
+
+    with profile_step("aggregation"):
+        summary = summarize(window, granularity)
+    first, last = window["date"].min(), window["date"].max()
+    periods = summary["period"]
+    report = "\n\n".join([
+        f"Sales from {first} to {last} by {granularity}:\n" + format_table(
+            ["Period", "SalesAmount", "SalesCount", "Customers"],
+            [(periods[0][i], float(periods[1][i]), int(periods[2][i]), int(round(periods[3][i])))
+             for i in range(len(periods[0]))]),
+        "Top 5 Selling Products by Sell Amount:\n" + format_table(
+            ["ProductDescription", "PurchaseAmount", "PurchaseCount"],
+            top_rows(summary["product"], summary["product"][1])),
+        "Top 5 Selling Products by Sell Count:\n" + format_table(
+            ["ProductDescription", "PurchaseAmount", "PurchaseCount"],
+            top_rows(summary["product"], summary["product"][2])),
+        "Top 5 Selling Categories:\n" + format_table(
+            ["ProductCategory", "PurchaseAmount", "PurchaseCount", "Customers"],
+            top_rows(summary["category"], summary["category"][1])),
+        f"Customers: {int(round(summary['total_customers']))} (estimated)\n"
+        f"Average Spending Per Customer: ${summary['total_amount'] / max(summary['total_customers'], 1):.2f}",
+    ])
+    print(report)
+
+    if not os.path.exists(OUTPUT_PATH):
+        os.makedirs(OUTPUT_PATH)
+    with open(ANALYSIS_WINDOW_OUTPUT_PATH, 'w') as f:
+        f.write(report + "\n")
+    print(f"Analysis complete! Results are saved at {ANALYSIS_WINDOW_OUTPUT_PATH}")
+    return summary
+
+
 if __name__ == '__main__':
     analysis()
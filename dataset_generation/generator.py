@@ -5,8 +5,9 @@ import random
 from faker import Faker
 from datetime import date
 
-from config import DATASET_PATH, PRODUCTS_PATH, DATA_PATH
+from config import DATASET_PATH, PRODUCTS_PATH, DATA_PATH, PARTITION_PATH
 from dataset_generation.generate_products import price_ranges
+from partitions import write_partitions
 
 
 def generate(
@@ -15,10 +16,12 @@ def generate(
         num_entries=7000,  # for generating ~= 5300 entries
         high_spender_ratio=0.1,
         occasional_ratio=0.3,
-        lost_ratio=0.1
+        lost_ratio=0.1,
+        num_partitions=None
 ):
     """
     Generates synthetic data for this project with high-spenders, occasional customers, and lost customers.
+    If num_partitions is set, the purchase log is also written as that many files partitioned by CustomerID hash.
     """
     # Generate customer and product IDs
     cid_list = [f"C{str(i).zfill(len(str(num_customers)))}" for i in range(1, num_customers + 1)]
@@ -80,6 +83,10 @@ def generate(
     df.to_csv(DATASET_PATH, index=False)
     print(f"Dataset with {df.shape[0]} entries saved to {DATASET_PATH}")
 
+    if num_partitions:
+        write_partitions([df], num_partitions)
+        print(f"Dataset partitioned into {num_partitions} files by CustomerID hash at {PARTITION_PATH}")
+
 
 if __name__ == "__main__":
     generate()
\ No newline at end of file
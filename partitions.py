@@ -0,0 +1,145 @@
+import json
+import os
+import shutil
+import zlib
+from multiprocessing import Pool
+
+import numpy as np
+
+from config import DATASET_PATH, PARTITION_PATH, DEFAULT_NUM_PARTITIONS, DEFAULT_PARTITION_CHUNK_SIZE
+from registry import is_stale
+
+PARTITION_MANIFEST_NAME = "manifest.json"
+
+
+def partition_of(customer_ids, num_partitions):
+    """
+    Partition of each customer: the CRC32 of its CustomerID modulo num_partitions.
+    Unlike hash(), CRC32 is the same in every process and Python version, so a customer's purchases always
+    land in the same partition.
+    """
+    unique_ids, inverse = np.unique(np.asarray(customer_ids, dtype=str), return_inverse=True)
+    hashes = np.array([zlib.crc32(cid.encode()) for cid in unique_ids], dtype=np.int64)
+    return (hashes % num_partitions)[inverse]
+
+
+def partition_file(index, path=PARTITION_PATH):
+    return path / f"part-{index:05d}.csv"
+
+
+def load_partition_manifest(path=PARTITION_PATH):
+    """
+    Loads the partition manifest (number of partitions and purchases per partition),
+    or returns None if the purchase log has not been partitioned.
+    """
+    if not os.path.exists(path / PARTITION_MANIFEST_NAME):
+        return None
+    with open(path / PARTITION_MANIFEST_NAME) as f:
+        return json.load(f)
+
+
+def save_partition_manifest(manifest, path=PARTITION_PATH):
+    temp_path = f"{path / PARTITION_MANIFEST_NAME}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_path, path / PARTITION_MANIFEST_NAME)
+
+
+def partition_files(path=PARTITION_PATH):
+    """
+    Paths of the partitions of the purchase log, or None if it has not been partitioned.
+    Warns if the single-file dataset changed since the partitions were written.
+    """
+    manifest = load_partition_manifest(path)
+    if manifest is None:
+        return None
+    if is_stale(path / PARTITION_MANIFEST_NAME, (DATASET_PATH,)):
+        print("Warning: the dataset changed since it was partitioned. Repartition it with 'python3 cli.py repartition'.")
+    return [partition_file(i, path) for i in range(manifest["num_partitions"])]
+
+
+def append_partitions(data, manifest, path=PARTITION_PATH):
+    """
+    Appends purchase records to the partitions of their customers and counts them in the manifest.
+    """
+    parts = partition_of(data['CustomerID'], manifest["num_partitions"])
+    for i in np.unique(parts):
+        rows = data[parts == i]
+        file = partition_file(int(i), path)
+        rows.to_csv(file, mode="a", header=not os.path.exists(file), index=False)
+        manifest["purchases"][int(i)] += len(rows)
+    return manifest
+
+
+def write_partitions(chunks, num_partitions=DEFAULT_NUM_PARTITIONS, path=PARTITION_PATH):
+    """
+    Writes purchase records, given as an iterable of DataFrame chunks, as num_partitions CSV files
+    hash-partitioned by CustomerID. Only one chunk is held in memory at a time.
+    The partitions are written next to the current ones and replace them at the end.
+    """
+    temp_path = path.parent / f"{path.name}.{os.getpid()}.tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    manifest = {"num_partitions": num_partitions, "purchases": [0] * num_partitions}
+    columns = []
+    for chunk in chunks:
+        append_partitions(chunk, manifest, temp_path)
+        columns = chunk.columns
+    # Partitions no customer hashes to still get a header, so every partition can be read
+    for i in range(num_partitions):
+        if not os.path.exists(partition_file(i, temp_path)):
+            with open(partition_file(i, temp_path), "w") as f:
+                f.write(",".join(columns) + "\n")
+    save_partition_manifest(manifest, temp_path)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(temp_path, path)
+    return manifest
+
+
+def concatenate_csv(paths, output_path):
+    """
+    Concatenates CSV files with the same header into output_path, keeping the header of the first one.
+    """
+    with open(output_path, "wb") as output:
+        for i, path in enumerate(paths):
+            with open(path, "rb") as f:
+                header = f.readline()
+                if i == 0:
+                    output.write(header)
+                shutil.copyfileobj(f, output)
+
+
+def map_partitions(func, args, workers=1, initializer=None, initargs=()):
+    """
+    Calls func(*arg) for every partition's arguments in args, on a pool of worker processes if workers > 1.
+    initializer(*initargs) runs once per worker, e.g. to load artifacts shared by the partitions.
+    Returns the results in partition order.
+    """
+    if workers <= 1 or len(args) <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        return [func(*arg) for arg in args]
+    with Pool(min(workers, len(args)), initializer=initializer, initargs=initargs) as pool:
+        return pool.starmap(func, args)
+
+
+def run(num_partitions=DEFAULT_NUM_PARTITIONS, chunk_size=DEFAULT_PARTITION_CHUNK_SIZE):
+    """
+    Repartitions the purchase log into num_partitions files, reading the dataset (or the current partitions,
+    if there is no single-file dataset) in chunks.
+    """
+    import pandas as pd
+    sources = [DATASET_PATH] if os.path.exists(DATASET_PATH) else partition_files()
+    if not sources:
+        print("Dataset not found.")
+        return
+    # Read the sources completely before their partition files are replaced
+    chunks = (chunk for source in sources for chunk in pd.read_csv(source, chunksize=chunk_size))
+    manifest = write_partitions(chunks, num_partitions)
+    print(f"{sum(manifest['purchases'])} purchase records written to {num_partitions} partitions "
+          f"by CustomerID hash at {PARTITION_PATH}")
+
+
+if __name__ == "__main__":
+    run()
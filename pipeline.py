@@ -0,0 +1,220 @@
+import contextlib
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import profiling
+from config import PIPELINE_MANIFEST_PATH, PIPELINE_LOG_PATH
+
+THREAD_ENV_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "NUMEXPR_NUM_THREADS"]
+
+
+class Stage:
+    """
+    A pipeline stage: a function with the files it reads and writes, and the parameters that affect its outputs.
+    threads is a resource hint: the number of threads the stage may use when stages run concurrently.
+    """
+
+    def __init__(self, name, func, args=(), inputs=(), outputs=(), params=None, threads=None):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        self.inputs = [str(path) for path in inputs]
+        self.outputs = [str(path) for path in outputs]
+        self.params = params or {}
+        self.threads = threads
+
+
+def file_hash(path, known_hashes):
+    """
+    SHA-256 of a file's content, or None if the file does not exist.
+    The hash recorded in known_hashes is reused while the file's size and modification time are unchanged.
+    """
+    if not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    known = known_hashes.get(path)
+    if known and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+        return known["sha256"]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    known_hashes[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": digest.hexdigest()}
+    return known_hashes[path]["sha256"]
+
+
+def load_manifest(manifest_path=PIPELINE_MANIFEST_PATH):
+    if not os.path.exists(manifest_path):
+        return {"files": {}, "stages": {}}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest, manifest_path=PIPELINE_MANIFEST_PATH):
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def stage_fingerprint(stage, known_hashes):
+    """
+    Content hashes of a stage's inputs and outputs together with its parameters.
+    """
+    return {
+        "inputs": {path: file_hash(path, known_hashes) for path in stage.inputs},
+        "outputs": {path: file_hash(path, known_hashes) for path in stage.outputs},
+        "params": json.loads(json.dumps(stage.params, default=str)),
+    }
+
+
+def is_up_to_date(stage, manifest):
+    """
+    A stage is up to date if it ran before with the same input contents and parameters,
+    and its outputs still exist unmodified.
+    """
+    recorded = manifest["stages"].get(stage.name)
+    if recorded is None:
+        return False
+    current = stage_fingerprint(stage, manifest["files"])
+    return (
+        current == recorded and
+        all(current["inputs"].values()) and
+        all(current["outputs"].values())
+    )
+
+
+def check_outputs(stage):
+    missing = [path for path in stage.outputs if not os.path.isfile(path)]
+    if missing:
+        raise RuntimeError(f"Stage '{stage.name}' did not produce {', '.join(missing)}")
+
+
+def stage_dependencies(stages):
+    """
+    A stage depends on every earlier stage that writes one of its inputs.
+    """
+    dependencies = {}
+    for i, stage in enumerate(stages):
+        dependencies[stage.name] = {
+            other.name for other in stages[:i] if set(other.outputs) & set(stage.inputs)
+        }
+    return dependencies
+
+
+def run_in_worker(stage, threads, profile=None):
+    """
+    Runs a stage in a worker process with its thread limit, writing its console output and logs to its own file.
+    With profile (see profiling.worker_settings), the stage is profiled and its events are returned
+    with the log file, to be merged into the parent's trace.
+    """
+    if profile is not None:
+        profiling.enable(**profile)
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    os.makedirs(PIPELINE_LOG_PATH, exist_ok=True)
+    log_file = PIPELINE_LOG_PATH / f"{stage.name}.log"
+
+    with open(log_file, "w") as f, contextlib.redirect_stdout(f), contextlib.redirect_stderr(f):
+        handler = logging.StreamHandler(f)
+        handler.setFormatter(logging.Formatter(f"%(asctime)s - %(levelname)s - [{stage.name}] %(message)s"))
+        root = logging.getLogger()
+        root.handlers = [handler]
+        root.setLevel(logging.INFO)
+
+        limits = contextlib.nullcontext()
+        try:
+            from threadpoolctl import threadpool_limits
+            limits = threadpool_limits(limits=threads)  # Libraries already loaded by a previous stage
+        except ImportError:
+            pass
+        if "torch" in sys.modules:
+            sys.modules["torch"].set_num_threads(threads)
+        with limits:
+            stage.func(*stage.args)
+    return str(log_file), profiling.recorded_events() if profile is not None else []
+
+
+def run_pipeline(stages, force=False, jobs=1, manifest_path=PIPELINE_MANIFEST_PATH):
+    """
+    Runs the stages, skipping those whose inputs and parameters are unchanged since their last run.
+
+    With jobs > 1, stages whose dependencies have completed run concurrently on a process pool.
+    A failure stops scheduling new stages. Once running stages have finished, the failure of the earliest
+    failed stage (in pipeline order) is raised, regardless of completion order.
+    The manifest is saved after every stage so that completed stages are kept if a later one fails.
+    """
+    manifest = load_manifest(manifest_path)
+    order = {stage.name: i for i, stage in enumerate(stages)}
+    dependencies = stage_dependencies(stages)
+    pending = list(stages)
+    done, executed, failures = set(), [], {}
+
+    def finish(stage, ran):
+        if ran:
+            check_outputs(stage)
+            manifest["stages"][stage.name] = stage_fingerprint(stage, manifest["files"])
+            save_manifest(manifest, manifest_path)
+            executed.append(stage.name)
+        done.add(stage.name)
+
+    def ready_stages():
+        ready = [stage for stage in pending if dependencies[stage.name] <= done]
+        for stage in ready:
+            pending.remove(stage)
+        return ready
+
+    if jobs <= 1:
+        for stage in stages:
+            if not force and is_up_to_date(stage, manifest):
+                logging.info(f"Skipping stage '{stage.name}': inputs and parameters unchanged.")
+                finish(stage, ran=False)
+            else:
+                stage.func(*stage.args)
+                finish(stage, ran=True)
+    else:
+        cpu_count = os.cpu_count() or 1
+        running = {}
+        # Create output directories upfront so that concurrent stages do not race to create them
+        for stage in stages:
+            for path in stage.outputs:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn")) as pool:
+            while pending or running:
+                if not failures:
+                    for stage in ready_stages():
+                        if not force and is_up_to_date(stage, manifest):
+                            logging.info(f"Skipping stage '{stage.name}': inputs and parameters unchanged.")
+                            finish(stage, ran=False)
+                            continue
+                        threads = stage.threads or max(1, cpu_count // jobs)
+                        logging.info(f"Starting stage '{stage.name}' with {threads} thread(s)...")
+                        running[pool.submit(run_in_worker, stage, threads, profiling.worker_settings())] = stage
+                if not running:
+                    if pending and not failures:
+                        continue  # Stages skipped above may have unblocked others
+                    break
+
+                completed, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    stage = running.pop(future)
+                    try:
+                        log_file, events = future.result()
+                        profiling.merge_events(events)
+                        finish(stage, ran=True)
+                        logging.info(f"Stage '{stage.name}' completed (log: {log_file}).")
+                    except Exception as e:
+                        failures[stage.name] = e
+                        logging.error(f"Stage '{stage.name}' failed: {e}")
+
+    if failures:
+        first = min(failures, key=order.get)
+        raise RuntimeError(f"Stage '{first}' failed") from failures[first]
+    logging.info(f"Pipeline finished: {len(executed)} of {len(stages)} stages ran"
+                 + (f" ({', '.join(executed)})." if executed else "."))
+    return executed
@@ -0,0 +1,151 @@
+import cProfile
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from config import PROFILE_OUTPUT_PATH
+
+# Profiling state. Stages and steps are no-ops unless enable() was called.
+_state = {
+    "enabled": False,
+    "cprofile": False,
+    "origin": 0.0,
+    "origin_time": 0.0,
+    "events": [],
+    "stack": [],
+}
+
+
+def enable(cprofile=False, origin_time=None):
+    """
+    Starts recording wall time, CPU time, peak memory and rows processed of every stage and step.
+    If cprofile is set, a cProfile dump is also written for every stage.
+    origin_time (a time.time() value) aligns the timestamps of a worker process with those of its parent.
+    """
+    now, now_time = time.perf_counter(), time.time()
+    origin_time = now_time if origin_time is None else origin_time
+    _state.update(enabled=True, cprofile=cprofile, origin=now - (now_time - origin_time), origin_time=origin_time,
+                  events=[], stack=[])
+    tracemalloc.start()
+
+
+def worker_settings():
+    """
+    Profiling settings to pass to a worker process (see enable), or None if profiling is disabled.
+    """
+    if not _state["enabled"]:
+        return None
+    return {"cprofile": _state["cprofile"], "origin_time": _state["origin_time"]}
+
+
+def recorded_events():
+    return list(_state["events"])
+
+
+def merge_events(events):
+    """
+    Adds events recorded in a worker process (with the worker's pid) to the trace of this process.
+    """
+    if _state["enabled"]:
+        _state["events"].extend(events)
+
+
+@contextmanager
+def profile_span(name, category):
+    if not _state["enabled"]:
+        yield
+        return
+
+    # tracemalloc has a single peak counter: hand the peak so far to the enclosing span before resetting it
+    stack = _state["stack"]
+    if stack:
+        stack[-1]["peak"] = max(stack[-1]["peak"], tracemalloc.get_traced_memory()[1])
+    tracemalloc.reset_peak()
+    span = {"peak": 0, "rows": None}
+    stack.append(span)
+
+    profiler = cProfile.Profile() if category == "stage" and _state["cprofile"] else None
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+        wall, cpu = time.perf_counter() - wall_start, time.process_time() - cpu_start
+        stack.pop()
+        span["peak"] = max(span["peak"], tracemalloc.get_traced_memory()[1])
+        if stack:
+            stack[-1]["peak"] = max(stack[-1]["peak"], span["peak"])
+
+        args = {"cpu_ms": round(cpu * 1000, 3), "peak_mem_mb": round(span["peak"] / 2 ** 20, 3)}
+        if span["rows"] is not None:
+            args["rows"] = span["rows"]
+        _state["events"].append({
+            "name": name,
+            "cat": category,
+            "ph": "X",  # Chrome trace complete event
+            "ts": round((wall_start - _state["origin"]) * 1e6, 1),
+            "dur": round(wall * 1e6, 1),
+            "pid": os.getpid(),
+            "tid": 0,
+            "args": args,
+        })
+        if profiler:
+            os.makedirs(PROFILE_OUTPUT_PATH, exist_ok=True)
+            profiler.dump_stats(PROFILE_OUTPUT_PATH / f"{name}.prof")
+
+
+def profile_stage(name):
+    """
+    Profiles a pipeline stage. Usable as a context manager or a function decorator.
+    """
+    return profile_span(name, "stage")
+
+
+def profile_step(name):
+    """
+    Profiles a sub-step of a stage, e.g. CSV load, date parsing, embedding, similarity, scoring or output write.
+    """
+    return profile_span(name, "step")
+
+
+def add_rows(rows):
+    """
+    Adds to the number of rows processed by the innermost running stage or step.
+    """
+    if _state["enabled"] and _state["stack"]:
+        span = _state["stack"][-1]
+        span["rows"] = (span["rows"] or 0) + int(rows)
+
+
+def write_trace():
+    """
+    Writes the recorded events as a Chrome trace (chrome://tracing, Perfetto) and prints a summary.
+    """
+    if not _state["enabled"]:
+        return
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+    os.makedirs(PROFILE_OUTPUT_PATH, exist_ok=True)
+    trace_file = PROFILE_OUTPUT_PATH / f"trace_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    with open(trace_file, "w") as f:
+        json.dump({
+            "traceEvents": _state["events"],
+            "displayTimeUnit": "ms",
+            "otherData": {"argv": sys.argv, "peak_rss_mb": round(peak_rss, 1)},
+        }, f)
+
+    print(f"\n{'Stage / step':<40}{'Wall (ms)':>12}{'CPU (ms)':>12}{'Peak mem (MB)':>15}{'Rows':>12}")
+    for event in sorted(_state["events"], key=lambda e: e["ts"]):
+        label = event["name"] if event["cat"] == "stage" else f"  {event['name']}"
+        print(f"{label:<40}{event['dur'] / 1000:>12.1f}{event['args']['cpu_ms']:>12.1f}"
+              f"{event['args']['peak_mem_mb']:>15.1f}{event['args'].get('rows', ''):>12}")
+    print(f"Peak RSS: {peak_rss:.1f} MB")
+    print(f">>> Profiling trace saved at {trace_file}")
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+from collections import OrderedDict
+
+from config import RECOMMENDATION_TEMP_PATH, REC_CACHE_PATH, PRODUCTS_PATH, DEFAULT_CACHE_SIZE, DEFAULT_CACHE_TTL
+
+# Cached results hold registry product codes, which follow the catalog order of the product file.
+# The registry file itself is left out: it is rewritten whenever purchases are appended, which would
+# invalidate every customer's results instead of only those of the customers who purchased something.
+ARTIFACT_FILES = [RECOMMENDATION_TEMP_PATH / name for name in [
+    "similarity_matrix.pkl", "similarity_scales.pkl", "pid_to_smid.pkl", "similarity_products.npy",
+    "product_metadata.csv", "candidates.pkl"]] + [PRODUCTS_PATH]
+RESULT_FORMAT = 3  # Bumped whenever the layout of cached recommendation results changes
+
+
+def artifact_version(files=ARTIFACT_FILES):
+    """
+    Version hash of the precomputed recommendation artifacts, derived from their size and modification time
+    so that it changes whenever an artifact is rewritten without hashing the artifacts themselves.
+    """
+    digest = hashlib.sha1()
+    for path in files:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:16]
+
+
+class RecommendationCache:
+    """
+    LRU cache of recommendation results with a TTL, backed by an optional on-disk SQLite tier.
+
+    Keys are (CustomerID, top_c, top_n, use_candidates, artifact version, customer's purchase count and last PurchaseID,
+    result format), so results are never served across artifact versions or after the customer purchased something new.
+    PurchaseIDs are not compared, since their zero-padding does not keep them in order past 99999 purchases.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL, disk_path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (created timestamp, value)
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.db = None
+        if disk_path is not None:
+            os.makedirs(os.path.dirname(disk_path), exist_ok=True)
+            self.db = sqlite3.connect(disk_path)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, cid TEXT NOT NULL, created REAL NOT NULL, value BLOB NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS cache_cid ON cache (cid)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS cache_created ON cache (created)")
+            self.disk_size = self.db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    @staticmethod
+    def make_key(cid, top_c, top_n, use_candidates, version, num_purchases, last_purchase_id):
+        # Plain Python types only, so that e.g. np.str_ and str IDs make the same key
+        return (str(cid), int(top_c), int(top_n), bool(use_candidates), str(version), int(num_purchases),
+                str(last_purchase_id), RESULT_FORMAT)
+
+    @staticmethod
+    def key_text(key):
+        return json.dumps(key)
+
+    def expired(self, created):
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key):
+        """
+        Returns the cached value of key, or None on a miss.
+        """
+        if key in self.entries:
+            created, value = self.entries[key]
+            if not self.expired(created):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self.entries[key]
+
+        if self.db is not None:
+            row = self.db.execute("SELECT created, value FROM cache WHERE key = ?", (self.key_text(key),)).fetchone()
+            if row is not None and not self.expired(row[0]):
+                value = pickle.loads(row[1])
+                self.put_memory(key, value, row[0])
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def put_memory(self, key, value, created):
+        self.entries[key] = (created, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, key, value):
+        created = time.time()
+        self.put_memory(key, value, created)
+        if self.db is not None:
+            key_text = self.key_text(key)
+            if self.db.execute("SELECT 1 FROM cache WHERE key = ?", (key_text,)).fetchone() is None:
+                self.disk_size += 1
+            self.db.execute(
+                "INSERT OR REPLACE INTO cache (key, cid, created, value) VALUES (?, ?, ?, ?)",
+                (key_text, key[0], created, pickle.dumps(value))
+            )
+            # Evict the oldest entries as soon as the on-disk tier is full, so that it never grows past max_size
+            if self.disk_size > self.max_size:
+                cursor = self.db.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY created LIMIT ?)",
+                    (self.disk_size - self.max_size,)
+                )
+                self.evictions += max(cursor.rowcount, 0)
+                self.disk_size = self.max_size
+
+    def invalidate(self, cids):
+        """
+        Drops every cached result of the given customers, e.g. after their new purchases were ingested.
+        """
+        cids = {str(cid) for cid in cids}
+        for key in [key for key in self.entries if key[0] in cids]:
+            del self.entries[key]
+        if self.db is not None:
+            self.db.executemany("DELETE FROM cache WHERE cid = ?", [(cid,) for cid in cids])
+            self.db.commit()
+            self.disk_size = self.db.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def close(self):
+        """
+        Expires entries past their TTL, bounds the on-disk tier to max_size entries and commits it.
+        """
+        if self.db is None:
+            return
+        if self.ttl is not None:
+            self.db.execute("DELETE FROM cache WHERE created < ?", (time.time() - self.ttl,))
+        cursor = self.db.execute(
+            "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY created DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,)
+        )
+        self.evictions += max(cursor.rowcount, 0)
+        self.db.commit()
+        self.db.close()
+        self.db = None
+
+    def metrics(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "size": len(self.entries),
+        }
+
+
+def open_cache(use_disk=True):
+    """
+    Opens the recommendation cache with the configured size, TTL and on-disk location.
+    """
+    return RecommendationCache(disk_path=REC_CACHE_PATH if use_disk else None)
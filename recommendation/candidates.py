@@ -0,0 +1,110 @@
+import os
+
+import pickle
+
+from config import DATASET_PATH, CLUSTER_OUTPUT_PATH, RECOMMENDATION_TEMP_PATH, DEFAULT_NUM_CANDIDATES
+
+
+def top_products(counts, top_n):
+    """
+    Returns the top_n ProductIDs of a purchase count series indexed by ProductID.
+    """
+    return counts.sort_values(ascending=False, kind="stable").head(top_n).index.tolist()
+
+
+def build_candidates(data, clustered_data, top_n=DEFAULT_NUM_CANDIDATES):
+    """
+    Precompute the top_n most purchased products per customer cluster, per category and overall.
+    """
+    customer_cluster = dict(zip(clustered_data['CustomerID'], clustered_data['Cluster'].astype(int)))
+    data = data.assign(Cluster=data['CustomerID'].map(customer_cluster))
+
+    # Candidates per cluster: what customers of the same segment buy most
+    cluster_counts = data.dropna(subset=['Cluster']).groupby(['Cluster', 'ProductID'])['PurchaseID'].count()
+    cluster_candidates = {
+        int(cluster): top_products(counts.droplevel('Cluster'), top_n)
+        for cluster, counts in cluster_counts.groupby(level='Cluster')
+    }
+
+    # Candidates per category: best sellers of each category
+    category_counts = data.groupby(['ProductCategory', 'ProductID'])['PurchaseID'].count()
+    category_candidates = {
+        category: top_products(counts.droplevel('ProductCategory'), top_n)
+        for category, counts in category_counts.groupby(level='ProductCategory')
+    }
+
+    # Global best sellers with their transaction counts, served to new customers
+    global_counts = data.groupby('ProductID')['PurchaseID'].count()
+    global_candidates = top_products(global_counts, top_n)
+
+    return {
+        "top_n": top_n,
+        "customer_cluster": customer_cluster,
+        "cluster": cluster_candidates,
+        "category": category_candidates,
+        "global": global_candidates,
+        "global_counts": global_counts[global_candidates].tolist(),
+    }
+
+
+def encode_candidates(candidates, registry):
+    """
+    Returns the candidate lists with their ProductIDs replaced by registry product codes.
+    """
+    return {
+        **candidates,
+        "cluster": {cluster: registry.encode_products(pids) for cluster, pids in candidates["cluster"].items()},
+        "category": {category: registry.encode_products(pids) for category, pids in candidates["category"].items()},
+        "global": registry.encode_products(candidates["global"]),
+    }
+
+
+def customer_candidates(candidates, cid, categories):
+    """
+    Returns the candidate products (ProductIDs, or product codes for encoded candidates) for an existing customer:
+    the candidates of the customer's cluster, of the given categories (the customer's top categories)
+    and the global best sellers, so at most (len(categories) + 2) * top_n products are scored.
+    """
+    pids = set(candidates["cluster"].get(candidates["customer_cluster"].get(cid), []))
+    for category in categories:
+        pids.update(candidates["category"].get(category, []))
+    pids.update(candidates["global"])
+    return sorted(pids)
+
+
+def load_candidates():
+    """
+    Loads the precomputed candidate lists, or returns None if they have not been computed.
+    """
+    if not os.path.exists(RECOMMENDATION_TEMP_PATH / "candidates.pkl"):
+        return None
+    with open(RECOMMENDATION_TEMP_PATH / "candidates.pkl", "rb") as f:
+        return pickle.load(f)
+
+
+def run(top_n=DEFAULT_NUM_CANDIDATES):
+    import pandas as pd
+    try:
+        data = pd.read_csv(DATASET_PATH)
+    except FileNotFoundError:
+        print("Dataset not found.")
+        return
+    try:
+        clustered_data = pd.read_csv(CLUSTER_OUTPUT_PATH / "clustered_data.csv")
+    except FileNotFoundError:
+        print("Error: 'clustered_data.csv' not found. Please complete k-means clustering.")
+        return
+
+    if not os.path.exists(RECOMMENDATION_TEMP_PATH):
+        os.makedirs(RECOMMENDATION_TEMP_PATH)
+
+    candidates = build_candidates(data, clustered_data, top_n)
+    with open(RECOMMENDATION_TEMP_PATH / "candidates.pkl", "wb") as f:
+        pickle.dump(candidates, f)
+
+    print(f"Top {top_n} candidates for {len(candidates['cluster'])} clusters and "
+          f"{len(candidates['category'])} categories saved.")
+
+
+if __name__ == "__main__":
+    run()
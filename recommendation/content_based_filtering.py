@@ -1,92 +1,154 @@
 import os.path
+import shutil
 
-import pandas as pd
+import numpy as np
 import pickle
-from collections import Counter
-from config import DATASET_PATH, PRODUCTS_PATH, RECOMMENDATION_TEMP_PATH, REC_OUTPUT_PATH
+from config import DATASET_PATH, RECOMMENDATION_TEMP_PATH, REC_OUTPUT_PATH, DEFAULT_PARTITION_WORKERS
+from registry import load_registry, load_product_registry
+from recommendation.candidates import load_candidates, customer_candidates, encode_candidates
+from recommendation.popularity import load_popularity, top_popular
+from recommendation.customer_index import load_customer_index, load_customer_history, load_indexed_customers, \
+    is_known_customer
+from recommendation.cache import RecommendationCache, artifact_version, open_cache
+from profiling import profile_step, add_rows
+from recommendation.quantization import dequantize_rows
+from recommendation.sparse_similarity import is_sparse
+from recommendation.output_writer import RecommendationWriter, output_file_name, output_format_available
 
 
-def recommend(data, similarity_matrix, pid_to_sm_row, product_metadata, cid, top_c=2, top_n=2):
+def rank_categories(purchases, registry):
     """
-    Get product recommendations for a specific customer using a similarity matrix.
+    Purchase count and first purchase position of each category in purchases (product codes),
+    and the category codes ordered by purchase count, ties broken by first purchase.
+    """
+    purchased_categories = registry.product_categories[purchases]
+    category_purchase_cnt = np.bincount(purchased_categories, minlength=registry.num_categories)
+    first_purchase = np.full(registry.num_categories, len(purchases))
+    np.minimum.at(first_purchase, purchased_categories, np.arange(len(purchases)))
+    return category_purchase_cnt, first_purchase, np.lexsort((first_purchase, -category_purchase_cnt))
+
+
+def top_category_names(purchases, registry, top_c):
+    """
+    Names of the top_c categories purchased most by a customer, as ranked by recommend().
+    """
+    purchases = np.asarray(purchases)
+    category_purchase_cnt, _, by_count = rank_categories(purchases[purchases >= 0], registry)
+    return registry.categories[by_count[category_purchase_cnt[by_count] > 0][:top_c]].tolist()
+
+
+def recommend(purchases, similarity_matrix, sm_rows, registry, top_c=2, top_n=2, candidates=None,
+              similarity_scales=None, return_scores=False):
+    """
+    Get product recommendations for a customer using a similarity matrix.
+    purchases holds the registry product codes of the customer's purchases (one per purchase),
+    and sm_rows the similarity matrix row of each product code (-1 for products without one).
+    If candidates (product codes) is given, only those products are scored.
+    The similarity matrix may be stored as float64, float16 or int8 (with per-row similarity_scales).
+    For a sparse top-k matrix, only products with a positive similarity to a purchased product are recommended,
+    so fewer than top_n products per category (and no novel product) may be returned.
+    Products are returned as product codes; best_match is -1 if no product qualifies.
+    If no purchased product has a similarity matrix row, there is nothing to rank by and no product is recommended.
+    With return_scores, also returns the scores of the familiar recommendations (similarity summed over
+    the purchase history) and of the novel one (highest similarity to a purchased product).
     """
     # Get the customer's purchase history
-    customer_data = data[data['CustomerID'] == cid]
-    purchased_products = customer_data['ProductID'].unique()
-    purchased_categories = customer_data['ProductCategory']
+    purchases = np.asarray(purchases)
+    purchases = purchases[purchases >= 0]
+    _, first_idx = np.unique(purchases, return_index=True)
+    purchased_products = purchases[np.sort(first_idx)]  # In order of first purchase
+    purchased_rows = sm_rows[purchased_products]
+    purchased_rows = purchased_rows[purchased_rows >= 0]
+    if not len(purchased_rows):
+        no_recommendations = np.array([], dtype=np.int32)
+        if return_scores:
+            return purchased_products, no_recommendations, -1, [], None
+        return purchased_products, no_recommendations, -1
 
-    # Get the top {top_categories} categories purchased most by the customer
-    category_purchase_cnt = Counter(purchased_categories)
-    top_categories = [cat for cat, _ in category_purchase_cnt.most_common(top_c)]
+    # Get the top {top_categories} categories purchased most by the customer, ties broken by first purchase
+    category_purchase_cnt, first_purchase, by_count = rank_categories(purchases, registry)
+    top_categories = by_count[category_purchase_cnt[by_count] > 0][:top_c]
 
-    # For each of the top categories, find recommendations and their similarity score.
-    recommendations = {}
-    for c in top_categories:
-        for pid in purchased_products:
-            for idx, score in sorted(enumerate(similarity_matrix[pid_to_sm_row[pid]]), key=lambda x: x[1], reverse=True):
-                similar_product = product_metadata.iloc[idx]['ProductID']
-                similar_category = product_metadata.iloc[idx]['ProductCategory']
-                if (
-                    # The recommendations should not be purchased before
-                    similar_product not in purchased_products and
-                    similar_category == c
-                ):
-                    recommendations[similar_product] = recommendations.get(similar_product, 0) + score
-
-    # Sort recommendations by score and select top_n per category
-    pid_to_category = dict(zip(product_metadata["ProductID"], product_metadata["ProductCategory"]))
+    # The recommendations should not be purchased before
+    eligible = sm_rows >= 0
+    eligible[purchased_products] = False
+    if candidates is not None:
+        candidates = np.asarray(candidates, dtype=np.int64)
+        is_candidate = np.zeros(registry.num_products, dtype=bool)
+        is_candidate[candidates[candidates >= 0]] = True
+        eligible &= is_candidate
+    eligible_idx = np.flatnonzero(eligible)
+    eligible_categories = registry.product_categories[eligible_idx]
+
+    # Similarity between each purchased product (rows) and each eligible product (columns)
+    similarity = dequantize_rows(similarity_matrix, similarity_scales, purchased_rows, sm_rows[eligible_idx])
+
+    # For each of the top categories, rank products by their similarity summed over the purchase history
+    # and select top_n per category
+    familiar_scores = similarity.sum(axis=0)
+    sparse_matrix = is_sparse(similarity_matrix)
     familiar_recommendations = []
+    familiar_recommendation_scores = []
     for c in top_categories:
-        category_recommendations = []
-        for pid, score in recommendations.items():
-            if pid_to_category[pid] == c:
-                category_recommendations.append((pid, score))
-        top_category_recommendations = sorted(category_recommendations, key=lambda x: x[1], reverse=True)[:top_n]
-        familiar_recommendations.extend([rec[0] for rec in top_category_recommendations])
+        category_idx = np.flatnonzero(eligible_categories == c)
+        if sparse_matrix:  # Products that are no stored neighbour of a purchase have no score to rank by
+            category_idx = category_idx[familiar_scores[category_idx] > 0]
+        ranked = category_idx[np.argsort(-familiar_scores[category_idx], kind='stable')[:top_n]]
+        familiar_recommendations.extend(eligible_idx[ranked])
+        familiar_recommendation_scores.extend(familiar_scores[ranked])
+    familiar_recommendations = np.asarray(familiar_recommendations, dtype=np.int32)
 
     # Add one product from the most unfamiliar category (unvisited or least bought)
     # That is the most similar to previously purchased products
-    unfamiliar_categories = set(product_metadata['ProductCategory']) - set(purchased_categories)
-    if not unfamiliar_categories:
-        unfamiliar_categories = set(sorted(category_purchase_cnt, key=category_purchase_cnt.get)[:3])
-    potential_novel_products = product_metadata[
-        product_metadata['ProductCategory'].isin(unfamiliar_categories)
-    ]
-    best_match = None
-    best_score = -1
-    for pid in purchased_products:
-        for idx, score in sorted(enumerate(similarity_matrix[pid_to_sm_row[pid]]), key=lambda x: x[1], reverse=True):
-            similar_product = product_metadata.iloc[idx]['ProductID']
-            # If the similar product is eligible for recommendation, compare with current best match.
-            if (
-                    similar_product not in purchased_products and
-                    similar_product in potential_novel_products['ProductID'].values
-            ):
-                if score > best_score:
-                    best_match = similar_product
-                    best_score = score
+    unfamiliar_categories = category_purchase_cnt == 0
+    if not unfamiliar_categories.any():
+        unfamiliar_categories[np.lexsort((first_purchase, category_purchase_cnt))[:3]] = True
+    novel_idx = np.flatnonzero(unfamiliar_categories[eligible_categories])
+    novel_scores = similarity[:, novel_idx].max(axis=0) if len(novel_idx) else np.array([], dtype=np.float32)
+    if sparse_matrix:
+        novel_idx, novel_scores = novel_idx[novel_scores > 0], novel_scores[novel_scores > 0]
+    best_match = -1
+    best_match_score = None
+    if len(novel_idx):
+        best_match = int(eligible_idx[novel_idx[np.argmax(novel_scores)]])
+        best_match_score = novel_scores.max()
 
+    if return_scores:
+        return (purchased_products, familiar_recommendations, best_match, familiar_recommendation_scores,
+                best_match_score)
     return purchased_products, familiar_recommendations, best_match
 
 
-def print_products(products, pid_to_description, pid_to_category, num_products=None, title=None):
+def product_rows(registry, similarity_products):
+    """
+    Row of each product code in the similarity matrix, or -1 for products without one.
+    similarity_products holds the ProductID of each similarity matrix row.
+    """
+    rows = np.full(registry.num_products, -1, dtype=np.int64)
+    codes = registry.encode_products(similarity_products)
+    known = codes >= 0
+    rows[codes[known]] = np.flatnonzero(known)
+    return rows
+
+
+def print_products(products, registry, num_products=None, title=None):
     """
-    Prints products grouped by their categories to the console.
+    Prints products (product codes) grouped by their categories to the console.
     """
     if title:
         print(f"\n{title}")
 
     prod_dict = {}
-    for pid in products:
-        cat = pid_to_category[pid]
+    for code in products:
+        cat = registry.category_names(code)
         if cat not in prod_dict:
             prod_dict[cat] = []
-        prod_dict[cat].append(pid)
+        prod_dict[cat].append(code)
 
-    for cat, pids in prod_dict.items():
+    for cat, codes in prod_dict.items():
         print(f"\t{cat}")
-        for pid in pids[:num_products] if num_products else pids:
-            print(f"\t\t{pid_to_description[pid]}")
+        for code in codes[:num_products] if num_products else codes:
+            print(f"\t\t{registry.describe(code)}")
 
 
 def load_files():
@@ -100,113 +162,358 @@ def load_files():
         raise FileNotFoundError("Cannot find preprocessed data")
     with open(RECOMMENDATION_TEMP_PATH / "similarity_matrix.pkl", "rb") as f:
         similarity_matrix = pickle.load(f)
-    with open(RECOMMENDATION_TEMP_PATH / "pid_to_smid.pkl", "rb") as f:
-        pid_to_smid = pickle.load(f)
-    product_metadata = pd.read_csv(RECOMMENDATION_TEMP_PATH / "product_metadata.csv")
+    if os.path.exists(RECOMMENDATION_TEMP_PATH / "similarity_products.npy"):
+        similarity_products = np.load(RECOMMENDATION_TEMP_PATH / "similarity_products.npy")
+    else:  # Artifacts prepared before similarity_products.npy existed; unpickling the series imports pandas
+        with open(RECOMMENDATION_TEMP_PATH / "pid_to_smid.pkl", "rb") as f:
+            similarity_products = pickle.load(f).sort_values().index.to_numpy(dtype=str)
+    similarity_scales = None
+    if os.path.exists(RECOMMENDATION_TEMP_PATH / "similarity_scales.pkl"):
+        with open(RECOMMENDATION_TEMP_PATH / "similarity_scales.pkl", "rb") as f:
+            similarity_scales = pickle.load(f)
 
-    try:
-        products_df = pd.read_csv(PRODUCTS_PATH)
-    except FileNotFoundError:
-        print("Cannot find product data")
-        return
+    return similarity_matrix, similarity_scales, similarity_products
 
-    return similarity_matrix, pid_to_smid, product_metadata, products_df
 
+def print_table(columns, rows):
+    """
+    Prints rows under right-aligned column headers, like DataFrame.to_string(index=False) without pandas.
+    """
+    cells = [[str(column) for column in columns]] + \
+            [[f"{value:.6f}" if isinstance(value, float) else str(value) for value in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(columns))]
+    for row in cells:
+        print(" ".join(cell.rjust(width) for cell, width in zip(row, widths)))
 
-def run(customer_id, top_categories=2, top_n=3):
+
+def read_customer_history(customer_id):
+    """
+    Reads the purchases of one customer from the unindexed purchase log,
+    in the same column name to string array form as load_customer_history.
+    """
+    import pandas as pd
+    data = pd.read_csv(DATASET_PATH, dtype=str)
+    history = data[data['CustomerID'] == customer_id]
+    return {column: history[column].to_numpy(dtype=str) for column in history.columns}
+
+
+def print_top_sellers(data, candidates=None, registry=None, num_products=5):
+    """
+    Prints the most purchased products to the console.
+    Uses the precomputed global candidate list (as product codes) if available.
+    """
+    if candidates is not None:
+        rows = list(zip(registry.describe(candidates["global"]), candidates["global_counts"]))
+    else:
+        counts = data.groupby('ProductDescription')['PurchaseID'].count().sort_values(ascending=False)
+        rows = list(counts.items())
+    print_table(['Top Seller Product', 'TransactionCount'], rows[:num_products])
+
+
+def print_popular(popularity, registry, num_products=5):
+    """
+    Prints the most popular products of the precomputed popularity table to the console.
+    """
+    rows = top_popular(popularity, num_products)
+    codes = registry.encode_products([pid for pid, _ in rows])
+    print_table(['Popular Product', 'PopularityScore'],
+                [(registry.describe(code) if code >= 0 else pid, score) for code, (pid, score) in zip(codes, rows)])
+
+
+def run(customer_id, top_categories=2, top_n=3, use_candidates=False, use_cache=True):
     """
     Generate recommendations for a specified customer.
+    If use_candidates is set, only the precomputed candidates of the customer's cluster and top categories
+    and the overall best sellers are scored.
     """
-    data = pd.read_csv(DATASET_PATH)
+    # Serve new customers from the precomputed popularity table without reading the dataset.
+    # Customers are looked up in the memory-mapped customer array of the offset index, which reads only a few pages,
+    # or in the registry if the log is not indexed. Descriptions come from the product side of the registry
+    registry = None
+    popularity = load_popularity()
+    if popularity is not None:
+        customers = load_indexed_customers()
+        if customers is not None:
+            known = is_known_customer(customer_id, customers)
+        else:
+            registry = load_registry()
+            known = registry.encode_customers([customer_id])[0] >= 0
+        if not known:
+            print("Welcome, new customer. Recommending most popular products:")
+            print_popular(popularity, registry if registry is not None else load_product_registry())
+            return
+
+    index = load_customer_index()
+    registry = registry if registry is not None else load_registry()
+
+    # Read only the customer's purchase history if the purchase log is indexed by customer
+    with profile_step("csv_load"):
+        if index is not None:
+            history = load_customer_history(customer_id, index)
+        else:
+            history = read_customer_history(customer_id)
+        add_rows(0 if history is None else len(history["CustomerID"]))
+    candidates = load_candidates()
+    if candidates is not None:
+        candidates = encode_candidates(candidates, registry)
 
     # Get recommendations (top-seller products) for new customers
-    if customer_id not in data["CustomerID"].unique():
+    if history is None or not len(history["CustomerID"]):
         print("Welcome, new customer. Recommending most purchased products:")
-        top_products = (data.groupby('ProductDescription')['PurchaseID']
-                        .count()
-                        .reset_index()  # Convert series to DataFrame
-                        .rename(
-            columns={'ProductDescription': 'Top Seller Product', 'PurchaseID': 'TransactionCount'}))
-        top_products = top_products.sort_values(by='TransactionCount', ascending=False)
-        print(top_products.head(5).to_string(index=False))
+        data = None
+        if candidates is None:
+            import pandas as pd
+            data = pd.read_csv(DATASET_PATH)
+        print_top_sellers(data, candidates, registry)
         return
 
-    try:
-        similarity_matrix, pid_to_smid, product_metadata, products_df = load_files()
-    except FileNotFoundError as e:
-        print(e)
-        return
-    pid_to_description = dict(zip(products_df["ProductID"], products_df["ProductDescription"]))
+    # Serve repeated requests from the cache while neither the artifacts nor the customer's history changed
+    cache = open_cache() if use_cache else None
+    result = None
+    if cache is not None:
+        cache_key = RecommendationCache.make_key(customer_id, top_categories, top_n, use_candidates,
+                                                 artifact_version(), len(history['PurchaseID']),
+                                                 history['PurchaseID'][-1])
+        result = cache.get(cache_key)
+
+    if result is None:
+        try:
+            with profile_step("artifact_load"):
+                similarity_matrix, similarity_scales, similarity_products = load_files()
+        except FileNotFoundError as e:
+            print(e)
+            return
+
+        if use_candidates and candidates is None:
+            print("Candidate lists not found. Scoring the whole catalog.")
+        purchases = registry.encode_products(history['ProductID'])
+        candidate_codes = customer_candidates(candidates, customer_id,
+                                              top_category_names(purchases, registry, top_categories)) \
+            if use_candidates and candidates else None
 
-    purchased_products, familiar_recommendations, best_match = \
-        recommend(data, similarity_matrix, pid_to_smid, product_metadata, customer_id, top_c=top_categories, top_n=top_n)
+        with profile_step("scoring"):
+            result = recommend(purchases, similarity_matrix,
+                               product_rows(registry, similarity_products), registry, top_c=top_categories, top_n=top_n,
+                               candidates=candidate_codes, similarity_scales=similarity_scales,
+                               return_scores=True)
+            add_rows(1)
+        if cache is not None:
+            cache.put(cache_key, result)
+    else:
+        print("Serving cached recommendations.")
+    if cache is not None:
+        cache.close()
+
+    purchased_products, familiar_recommendations, best_match, familiar_scores, best_match_score = result
+
+    # Serve customers whose purchases have no similarity data like new customers
+    if not len(familiar_recommendations) and best_match < 0:
+        print("No similar products found for the customer's purchases.")
+        if popularity is not None:
+            print("Recommending most popular products:")
+            print_popular(popularity, registry)
+        else:
+            print("Recommending most purchased products:")
+            data = None
+            if candidates is None:
+                import pandas as pd
+                data = pd.read_csv(DATASET_PATH)
+            print_top_sellers(data, candidates, registry)
+        return
 
     # Print results to the console
-    pid_to_category = dict(zip(products_df["ProductID"], products_df["ProductCategory"]))
     print_products(  # Print purchase history
         purchased_products,
-        pid_to_description,
-        pid_to_category,
+        registry,
         title=f"Customer {customer_id}'s purchase history:"
     )
     print_products(  # Print familiar recommendations
         familiar_recommendations,
-        pid_to_description,
-        pid_to_category,
+        registry,
         num_products=top_n,
         title="Recommendations (familiar):"
     )
     print_products(  # Print novel recommendation
-        [best_match],
-        pid_to_description,
-        pid_to_category,
+        [best_match] if best_match >= 0 else [],
+        registry,
         num_products=top_n,
         title="Recommendations (novel):"
     )
 
     if not os.path.exists(REC_OUTPUT_PATH):
         os.makedirs(REC_OUTPUT_PATH)
-    with open(REC_OUTPUT_PATH / f"{customer_id}.csv", "w") as f:
-        f.write("CustomerID,RecID01,RecDesc01,RecID02,RecDesc02,RecID03,RecDesc03,UnfamRecID01,UnfamRecDesc01\n")
-        f.write(f"{customer_id},")
-        for r in familiar_recommendations:
-            f.write(f"{r},{pid_to_description[r]},")
-        f.write(f"{best_match},{pid_to_description[best_match]}")
+    with profile_step("output_write"):
+        writer = RecommendationWriter(1, top_categories * top_n)
+        writer.add(registry.encode_customers([customer_id])[0], familiar_recommendations, familiar_scores,
+                   best_match, best_match_score)
+        writer.write_csv(REC_OUTPUT_PATH / f"{customer_id}.csv", registry)
     print("Recommendations done! Results are saved at ", REC_OUTPUT_PATH)
 
 
-def run_all(top_categories=2, top_n=3):
+def recommend_customers(data, registry, artifacts, top_categories, top_n, use_candidates, output_format="csv",
+                        long_format=False, cache=None, version=None):
+    """
+    Recommends for every customer of a purchase log (PurchaseID, CustomerID and ProductID columns)
+    and returns a writer holding the results.
+    artifacts holds the similarity matrix, its scales, the similarity row of each product code and the encoded
+    candidates (or None).
+    """
+    similarity_matrix, similarity_scales, sm_rows, candidates = artifacts
+
+    # Split the purchase log by customer with a single sort of the customer codes
+    customer_codes = registry.encode_customers(data['CustomerID'])
+    order = np.argsort(customer_codes, kind='stable')
+    customer_codes = customer_codes[order]
+    product_codes = registry.encode_products(data['ProductID'])[order]
+    starts = np.flatnonzero(np.r_[True, customer_codes[1:] != customer_codes[:-1]]) if len(order) else order
+    # Purchase count and last PurchaseID (in log order) of each customer, which change with every new purchase
+    num_purchases = np.diff(np.r_[starts, len(order)])
+    last_purchase_ids = data['PurchaseID'].to_numpy()[order][starts + num_purchases - 1]
+
+    writer = RecommendationWriter(len(starts), top_categories * top_n, output_format, long_format)
+    with profile_step("scoring"):
+        for i, (code, purchases) in enumerate(zip(customer_codes[starts], np.split(product_codes, starts[1:]))):
+            cid = str(registry.customer_ids[code])
+            cache_key = RecommendationCache.make_key(cid, top_categories, top_n, use_candidates, version,
+                                                     num_purchases[i], last_purchase_ids[i])
+            result = cache.get(cache_key) if cache is not None else None
+            if result is None:
+                candidate_codes = customer_candidates(candidates, cid,
+                                                      top_category_names(purchases, registry, top_categories)) \
+                    if candidates else None
+                result = recommend(purchases, similarity_matrix, sm_rows, registry, top_c=top_categories,
+                                   top_n=top_n, candidates=candidate_codes, similarity_scales=similarity_scales,
+                                   return_scores=True)
+                if cache is not None:
+                    cache.put(cache_key, result)
+            purchased_products, familiar_recommendations, best_match, familiar_scores, best_match_score = result
+            writer.add(code, familiar_recommendations, familiar_scores, best_match, best_match_score)
+            add_rows(1)
+    return writer
+
+
+# Artifacts loaded once per worker process of the partitioned content-filter-all
+_partition_worker = {}
+
+
+def init_partition_worker(use_candidates, registry):
+    similarity_matrix, similarity_scales, similarity_products = load_files()
+    candidates = load_candidates() if use_candidates else None
+    if candidates is not None:
+        candidates = encode_candidates(candidates, registry)
+    _partition_worker.update(registry=registry, artifacts=(
+        similarity_matrix, similarity_scales, product_rows(registry, similarity_products), candidates))
+
+
+def recommend_partition(path, output_path, top_categories, top_n, use_candidates, output_format, long_format):
+    """
+    Map step of the partitioned content-filter-all: recommends for the customers of one partition of the purchase
+    log and writes the results to output_path. Returns the number of rows written.
+    """
+    import pandas as pd
+    data = pd.read_csv(path, usecols=['PurchaseID', 'CustomerID', 'ProductID'])
+    # Customer codes local to the partition, so the registry only needs to know the products
+    registry = _partition_worker["registry"].with_customers(data['CustomerID'])
+    writer = recommend_customers(data, registry, _partition_worker["artifacts"], top_categories, top_n,
+                                 use_candidates, output_format, long_format)
+    return writer.write(output_path, registry)
+
+
+def run_all_partitioned(top_categories=2, top_n=3, use_candidates=False, output_format="csv", long_format=False,
+                        workers=DEFAULT_PARTITION_WORKERS):
+    """
+    Generate recommendations for all customers as a map-reduce job over the partitions of the purchase log.
+    Each worker process loads the artifacts once and writes the results of its partitions. The part files are
+    concatenated into one CSV file, or kept as the files of a Parquet dataset directory.
+    The recommendation cache is not used, as its SQLite tier allows a single writer at a time.
+    """
+    from partitions import partition_files, map_partitions, concatenate_csv
+    paths = partition_files()
+    if paths is None:
+        print("Partitioned dataset not found. Please run 'python3 cli.py repartition'.")
+        return
+    if (
+            not os.path.exists(RECOMMENDATION_TEMP_PATH / "similarity_matrix.pkl") or
+            not os.path.exists(RECOMMENDATION_TEMP_PATH / "pid_to_smid.pkl")
+    ):
+        print("Cannot find preprocessed data")
+        return
+    # Workers only need product codes, so neither the customer IDs nor the whole purchase log are read here
+    registry = load_product_registry()
+    if use_candidates and load_candidates() is None:
+        print("Candidate lists not found. Scoring the whole catalog.")
+
+    output_path = REC_OUTPUT_PATH / output_file_name("all", output_format, long_format)
+    parts_path = output_path if output_format == "parquet" else REC_OUTPUT_PATH / f"{output_path.name}.parts"
+    if os.path.isdir(output_path):
+        shutil.rmtree(output_path)
+    elif os.path.exists(output_path):
+        os.remove(output_path)
+    os.makedirs(parts_path, exist_ok=True)
+    part_paths = [parts_path / f"part-{i:05d}.{output_format}" for i in range(len(paths))]
+
+    with profile_step("map_recommend"):
+        rows = map_partitions(recommend_partition,
+                              [(path, part_path, top_categories, top_n, use_candidates, output_format, long_format)
+                               for path, part_path in zip(paths, part_paths)],
+                              workers, init_partition_worker, (use_candidates, registry))
+        add_rows(sum(rows))
+    if output_format == "csv":
+        with profile_step("output_write"):
+            concatenate_csv(part_paths, output_path)
+        shutil.rmtree(parts_path)
+    print("Recommendations done! Results are saved at ", output_path)
+
+
+def run_all(top_categories=2, top_n=3, use_candidates=False, use_cache=False, output_format="csv",
+            long_format=False, partitioned=False, workers=DEFAULT_PARTITION_WORKERS):
     """
     Generate recommendations for all customers.
+    Results are collected in memory and written at once, as CSV or Parquet, in wide or long format.
+    With partitioned, runs over the partitions of the purchase log on workers processes instead.
     """
-    data = pd.read_csv(DATASET_PATH)
+    if not output_format_available(output_format):
+        print(f"Output format '{output_format}' is not available. Parquet output requires pyarrow.")
+        return
+    if partitioned:
+        run_all_partitioned(top_categories, top_n, use_candidates, output_format, long_format, workers)
+        return
+    import pandas as pd
+    with profile_step("csv_load"):
+        data = pd.read_csv(DATASET_PATH, usecols=['PurchaseID', 'CustomerID', 'ProductID'])
+        add_rows(len(data))
     try:
-        similarity_matrix, pid_to_smid, product_metadata, products_df = load_files()
+        with profile_step("artifact_load"):
+            similarity_matrix, similarity_scales, similarity_products = load_files()
     except FileNotFoundError as e:
         print(e)
         return
-    pid_to_description = dict(zip(products_df["ProductID"], products_df["ProductDescription"]))
+    registry = load_registry()
+    sm_rows = product_rows(registry, similarity_products)
+    candidates = load_candidates() if use_candidates else None
+    if use_candidates and candidates is None:
+        print("Candidate lists not found. Scoring the whole catalog.")
+    if candidates is not None:
+        candidates = encode_candidates(candidates, registry)
+    cache = open_cache() if use_cache else None
+    version = artifact_version()
 
     if not os.path.exists(REC_OUTPUT_PATH):
         os.makedirs(REC_OUTPUT_PATH)
 
-    with (open(REC_OUTPUT_PATH / f"all.csv", "w") as f):
-        # Write CSV header
-        f.write("CustomerID,")
-        for i in range(top_categories * top_n):
-            f.write(f"RecID{i},RecDesc{i},")
-        f.write("NovelRecID,NovelRecDesc\n")
-
-        for cid in sorted(data["CustomerID"].unique()):
-            purchased_products, familiar_recommendations, best_match = \
-                recommend(data, similarity_matrix, pid_to_smid, product_metadata, cid, top_c=top_categories, top_n=top_n)
-            f.write(f"{cid},")
-            for r in familiar_recommendations:
-                f.write(f"{r},{pid_to_description[r]},")
-            f.write(f"{best_match},{pid_to_description[best_match]}")
-            f.write("\n")
+    writer = recommend_customers(data, registry, (similarity_matrix, similarity_scales, sm_rows, candidates),
+                                 top_categories, top_n, use_candidates, output_format, long_format, cache, version)
 
-    print("Recommendations done! Results are saved at ", REC_OUTPUT_PATH)
+    output_path = REC_OUTPUT_PATH / output_file_name("all", output_format, long_format)
+    if os.path.isdir(output_path):  # Parquet dataset directory of a partitioned run
+        shutil.rmtree(output_path)
+    with profile_step("output_write"):
+        add_rows(writer.write(output_path, registry))
+
+    if cache is not None:
+        cache.close()
+        print(f"Recommendation cache: {cache.metrics()}")
+    print("Recommendations done! Results are saved at ", output_path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,115 @@
+import csv
+import io
+import os
+
+import numpy as np
+
+from config import DATASET_PATH, RECOMMENDATION_TEMP_PATH
+from registry import is_stale
+
+SORTED_DATASET_PATH = RECOMMENDATION_TEMP_PATH / "dataset_by_customer.csv"
+CUSTOMER_INDEX_PATH = RECOMMENDATION_TEMP_PATH / "customer_index.npz"
+INDEXED_CUSTOMERS_PATH = RECOMMENDATION_TEMP_PATH / "indexed_customers.npy"  # Sorted customers, memory-mapped
+
+
+def build_customer_index(data):
+    """
+    Writes the purchase log sorted by CustomerID and returns its offset index:
+    the sorted customer IDs with the byte range and row range of each customer's purchases.
+    """
+    data = data.sort_values(['CustomerID', 'PurchaseDate'], kind='stable').reset_index(drop=True)
+    data.to_csv(SORTED_DATASET_PATH, index=False, lineterminator='\n')
+
+    # Byte offset of every line start: the header is line 0, purchase i is line i + 1
+    with open(SORTED_DATASET_PATH, 'rb') as f:
+        content = np.frombuffer(f.read(), dtype=np.uint8)
+    line_starts = np.concatenate(([0], np.flatnonzero(content == ord('\n')) + 1))
+
+    # Row ranges of each customer in the sorted log
+    cids = data['CustomerID'].to_numpy(dtype=str)
+    row_starts = np.concatenate(([0], np.flatnonzero(cids[1:] != cids[:-1]) + 1))
+    row_ends = np.append(row_starts[1:], len(cids))
+
+    return {
+        "customers": cids[row_starts],
+        "row_starts": row_starts,
+        "row_ends": row_ends,
+        "byte_starts": line_starts[row_starts + 1],
+        "byte_ends": line_starts[row_ends + 1],
+        "header_end": line_starts[1],
+    }
+
+
+def load_customer_index():
+    """
+    Loads the customer offset index, or returns None if it has not been built
+    or the dataset changed since (so that histories are read from the dataset instead).
+    """
+    if not os.path.exists(CUSTOMER_INDEX_PATH) or not os.path.exists(SORTED_DATASET_PATH):
+        return None
+    if is_stale(CUSTOMER_INDEX_PATH, (DATASET_PATH,)):
+        print("Warning: the dataset changed since the customer index was built. Reading the dataset instead. "
+              "Rebuild the index with 'python3 cli.py recommendation index-customers'.")
+        return None
+    with np.load(CUSTOMER_INDEX_PATH) as index:
+        return {key: index[key] for key in index.files}
+
+
+def load_indexed_customers():
+    """
+    Memory-maps the sorted customer IDs of the offset index, so that looking up a customer reads only the pages
+    its binary search touches. Returns None if the index has not been built or the dataset changed since.
+    """
+    if not os.path.exists(INDEXED_CUSTOMERS_PATH) or is_stale(INDEXED_CUSTOMERS_PATH, (DATASET_PATH,)):
+        return None
+    return np.load(INDEXED_CUSTOMERS_PATH, mmap_mode='r')
+
+
+def is_known_customer(cid, customers):
+    """
+    Binary search for a customer in a sorted customer array.
+    """
+    i = np.searchsorted(customers, cid)
+    return i < len(customers) and customers[i] == cid
+
+
+def load_customer_history(cid, index):
+    """
+    Reads only the purchase records of one customer from the sorted log,
+    as a dict of column name to string array. Returns None if the customer is not in the index.
+    """
+    customers = index["customers"]
+    i = np.searchsorted(customers, cid)
+    if i == len(customers) or customers[i] != cid:
+        return None
+
+    with open(SORTED_DATASET_PATH, 'rb') as f:
+        header = f.read(int(index["header_end"]))
+        f.seek(int(index["byte_starts"][i]))
+        rows = f.read(int(index["byte_ends"][i] - index["byte_starts"][i]))
+    reader = csv.reader(io.StringIO((header + rows).decode()))
+    columns = next(reader)
+    records = np.array(list(reader), dtype=str).reshape(-1, len(columns))
+    return {column: records[:, i] for i, column in enumerate(columns)}
+
+
+def run():
+    import pandas as pd
+    try:
+        data = pd.read_csv(DATASET_PATH)
+    except FileNotFoundError:
+        print("Dataset not found.")
+        return
+
+    if not os.path.exists(RECOMMENDATION_TEMP_PATH):
+        os.makedirs(RECOMMENDATION_TEMP_PATH)
+
+    index = build_customer_index(data)
+    np.savez(CUSTOMER_INDEX_PATH, **index)
+    np.save(INDEXED_CUSTOMERS_PATH, index["customers"])
+    print(f"Purchase log sorted by customer saved at {SORTED_DATASET_PATH}")
+    print(f"Offset index of {len(index['customers'])} customers saved at {CUSTOMER_INDEX_PATH}")
+
+
+if __name__ == "__main__":
+    run()
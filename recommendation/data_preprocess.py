@@ -1,17 +1,24 @@
 import os
 
-from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.feature_extraction.text import CountVectorizer, TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
+import numpy as np
 import pandas as pd
 import pickle
 
-from config import RECOMMENDATION_TEMP_PATH, PRODUCTS_PATH
+from config import RECOMMENDATION_TEMP_PATH, PRODUCTS_PATH, DEFAULT_PRECISION, PRECISION_OVERLAP_K, \
+    PRECISION_OVERLAP_TOLERANCE, DEFAULT_EMBEDDING_BATCH_SIZE, DEFAULT_EMBEDDING_WORKERS
+from recommendation.encoders import load_encoder, encode_texts
+from recommendation.quantization import PRECISIONS, SPARSE_PRECISIONS, quantize, neighbour_overlap, stored_nbytes
+from recommendation.sparse_similarity import top_k_similarity
+from profiling import profile_step, add_rows
 
 
-def data_process_nlp(data: pd.DataFrame):
+def data_process_nlp(data: pd.DataFrame, batch_size=DEFAULT_EMBEDDING_BATCH_SIZE,
+                     num_workers=DEFAULT_EMBEDDING_WORKERS):
     """
     Computes cosine similarity using pretrained models in Sentence Transformers.
+    Also returns the product embeddings.
     """
 
     # Combine ProductCategory and ProductDescription for better similarity analysis
@@ -20,25 +27,32 @@ def data_process_nlp(data: pd.DataFrame):
             data['ProductDescription'].fillna("").str.strip().str.lower()
     )
 
-    model = SentenceTransformer('all-MiniLM-L6-v2')  # Load a lightweight model since dataset is small
+    # A lightweight model (all-MiniLM-L6-v2) by default since dataset is small
+    encoder = load_encoder(batch_size=batch_size, num_workers=num_workers)
 
     print("Generating embeddings for product metadata...")
-    embeddings = model.encode(data['CombinedMetadata'].tolist(), show_progress_bar=True)
+    with profile_step("embedding"):
+        embeddings, stats = encode_texts(encoder, data['CombinedMetadata'].tolist())
+        add_rows(len(data))
+    print(f"Encoded {stats['texts']} texts ({stats['unique_texts']} unique) in {stats['seconds']:.2f}s: "
+          f"{stats['texts_per_second']:.1f} texts/s")
 
     print("Computing similarity matrix...")
-    similarity_matrix = cosine_similarity(embeddings)
+    with profile_step("similarity"):
+        similarity_matrix = cosine_similarity(embeddings)
 
     # Map ProductID to index in the similarity matrix
     pid_to_smid = pd.Series(data.index, index=data['ProductID'])
 
-    return similarity_matrix, pid_to_smid, data
+    return similarity_matrix, pid_to_smid, data, embeddings
 
 
-def data_process_pairwise(data: pd.DataFrame):
+def data_process_pairwise(data: pd.DataFrame, top_k=None):
     """
     Please use the NLP version data processing instead, for better recommendation performance.
 
     Precomputes cosine similarity using pairwise distances.
+    With top_k, computes a sparse TF-IDF similarity matrix keeping the top_k most similar products per product.
     """
     # Combine ProductCategory and ProductDescription for better similarity analysis
     data['CombinedMetadata'] = (
@@ -47,38 +61,92 @@ def data_process_pairwise(data: pd.DataFrame):
     )
 
     # Compute cosine similarity between products
-    vectorizer = CountVectorizer(max_features=1000)
-    metadata_matrix = vectorizer.fit_transform(data['CombinedMetadata'])
-    similarity_matrix = cosine_similarity(metadata_matrix, metadata_matrix)
+    if top_k is not None:
+        vectorizer = TfidfVectorizer()  # Rows are L2-normalized, so their dot products are cosine similarities
+        with profile_step("vectorize"):
+            metadata_matrix = vectorizer.fit_transform(data['CombinedMetadata'])
+        with profile_step("similarity"):
+            similarity_matrix = top_k_similarity(metadata_matrix, top_k)
+        print(f"Sparse similarity matrix: {similarity_matrix.nnz} stored similarities "
+              f"({similarity_matrix.nnz / max(similarity_matrix.shape[0], 1):.1f} per product)")
+    else:
+        vectorizer = CountVectorizer(max_features=1000)
+        with profile_step("vectorize"):
+            metadata_matrix = vectorizer.fit_transform(data['CombinedMetadata'])
+        with profile_step("similarity"):
+            similarity_matrix = cosine_similarity(metadata_matrix, metadata_matrix)
 
     # Map pid to index in the similarity matrix
     pid_to_smid = pd.Series(data.index, index=data['ProductID'])
     return similarity_matrix, pid_to_smid, data
 
 
-def run(method='nlp'):
+def report_precision(similarity_matrix, stored_matrix, scales, precision):
+    """
+    Prints the size reduction of the stored similarity matrix and how well it preserves each product's
+    nearest neighbours compared to the float64 baseline.
+    """
+    reduction = stored_nbytes(similarity_matrix.astype(np.float64)) / stored_nbytes(stored_matrix)
+    overlap = neighbour_overlap(similarity_matrix, stored_matrix, scales, k=PRECISION_OVERLAP_K)
+    print(f"Similarity matrix stored as {precision}: {reduction:.1f}x smaller than float64, "
+          f"neighbour overlap@{PRECISION_OVERLAP_K} = {overlap:.4f} (tolerance {PRECISION_OVERLAP_TOLERANCE})")
+    if overlap < PRECISION_OVERLAP_TOLERANCE:
+        print(f"Warning: {precision} storage changes the nearest neighbours beyond the tolerance. "
+              f"Consider a higher precision.")
+
+
+def run(method='nlp', precision=DEFAULT_PRECISION, batch_size=DEFAULT_EMBEDDING_BATCH_SIZE,
+        num_workers=DEFAULT_EMBEDDING_WORKERS, top_k=None):
 
     if method not in ['nlp', 'pairwise']:
         print("Invalid data processing method argument. Valid methods are 'nlp' and 'pairwise'")
         return
+    if precision not in PRECISIONS:
+        print(f"Invalid precision argument. Valid precisions are {', '.join(PRECISIONS)}")
+        return
+    if top_k is not None and method != 'pairwise':
+        print("The top_k argument is only supported by the 'pairwise' method")
+        return
+    if top_k is not None and precision not in SPARSE_PRECISIONS:
+        print(f"Invalid precision argument for a sparse similarity matrix. "
+              f"Valid precisions are {', '.join(SPARSE_PRECISIONS)}")
+        return
 
     if not os.path.exists(RECOMMENDATION_TEMP_PATH):
         os.makedirs(RECOMMENDATION_TEMP_PATH)
 
     # Data preprocessing
-    data = pd.read_csv(PRODUCTS_PATH)
+    with profile_step("csv_load"):
+        data = pd.read_csv(PRODUCTS_PATH)
+        add_rows(len(data))
+    embeddings = None
     if method == 'nlp':
-        similarity_matrix, pid_to_smid, product_data = data_process_nlp(data)
+        similarity_matrix, pid_to_smid, product_data, embeddings = data_process_nlp(data, batch_size, num_workers)
     else:
-        similarity_matrix, pid_to_smid, product_data = data_process_pairwise(data)
+        similarity_matrix, pid_to_smid, product_data = data_process_pairwise(data, top_k)
+
+    # Reduce the storage precision of the similarity matrix (and embeddings)
+    stored_matrix, similarity_scales = quantize(similarity_matrix, precision)
+    if precision != "float64":
+        report_precision(similarity_matrix, stored_matrix, similarity_scales, precision)
 
     # Save results
     print("Saving results...")
-    with open(RECOMMENDATION_TEMP_PATH / "similarity_matrix.pkl", "wb") as f:
-        pickle.dump(similarity_matrix, f)
-    with open(RECOMMENDATION_TEMP_PATH / "pid_to_smid.pkl", "wb") as f:
-        pickle.dump(pid_to_smid, f)
-    product_data.to_csv(RECOMMENDATION_TEMP_PATH / "product_metadata.csv", index=False)
+    with profile_step("output_write"):
+        with open(RECOMMENDATION_TEMP_PATH / "similarity_matrix.pkl", "wb") as f:
+            pickle.dump(stored_matrix, f)
+        with open(RECOMMENDATION_TEMP_PATH / "similarity_scales.pkl", "wb") as f:
+            pickle.dump(similarity_scales, f)
+        if embeddings is not None:
+            stored_embeddings, embedding_scales = quantize(embeddings, precision)
+            np.savez(RECOMMENDATION_TEMP_PATH / "embeddings.npz", embeddings=stored_embeddings,
+                     scales=embedding_scales if embedding_scales is not None else np.array([]))
+        with open(RECOMMENDATION_TEMP_PATH / "pid_to_smid.pkl", "wb") as f:
+            pickle.dump(pid_to_smid, f)
+        # ProductID of each similarity matrix row, loadable without pandas
+        np.save(RECOMMENDATION_TEMP_PATH / "similarity_products.npy",
+                pid_to_smid.sort_values().index.to_numpy(dtype=str))
+        product_data.to_csv(RECOMMENDATION_TEMP_PATH / "product_metadata.csv", index=False)
 
     # print(f"Product metadata shape: {product_data.shape}")
     # print(f"Similarity matrix shape: {similarity_matrix.shape}")
@@ -1,34 +1,80 @@
 import pandas as pd
 import numpy as np
 
-from config import DATASET_PATH
+from config import DATASET_PATH, DEFAULT_PARTITION_WORKERS
+from registry import load_registry
+from partitions import partition_files, map_partitions
+from profiling import profile_step, add_rows
 
 
-def calculate_matrix_density(data):
+def calculate_matrix_density(data, registry):
     """
     Calculate the density of interaction matrix to determine the proper method for recommendation.
     """
-    # CustomerID x ProductID
-    interaction_matrix = data.pivot_table(
-        index='CustomerID',
-        columns='ProductID',
-        values='PurchaseAmount',
-        fill_value=0
-    )
+    # CustomerID x ProductID, as one integer key per (customer code, product code) pair.
+    # Only the nonzero entries are counted, so the interaction matrix is never materialized.
+    data = data.dropna(subset=['PurchaseAmount'])
+    customers = registry.encode_customers(data['CustomerID']).astype(np.int64)
+    products = registry.encode_products(data['ProductID']).astype(np.int64)
+    # Purchases of IDs missing from the registry (code -1) would alias the keys of other pairs
+    known = (customers >= 0) & (products >= 0)
+    customers, products = customers[known], products[known]
+    pairs, pair_idx = np.unique(customers * registry.num_products + products, return_inverse=True)
+    amounts = np.bincount(pair_idx.ravel(), weights=data['PurchaseAmount'].to_numpy()[known], minlength=len(pairs))
 
     # Matrix density = #nonzero-entries / #all-entries
-    cnt_all = interaction_matrix.size
-    cnt_nonzero = np.count_nonzero(interaction_matrix)
-    density = cnt_nonzero / cnt_all
+    cnt_all = len(np.unique(customers)) * len(np.unique(products))
+    cnt_nonzero = np.count_nonzero(amounts)
+    density = cnt_nonzero / cnt_all if cnt_all else 0.0
 
     # print(f"Matrix Shape: {interaction_matrix.shape}")
     print(f"Matrix Density: {density:.4f}")
     return density
 
 
-def run():
-    data = pd.read_csv(DATASET_PATH)
-    density = calculate_matrix_density(data)
+def density_partition(path):
+    """
+    Map step of the partitioned density check: the customers, products and nonzero interactions of a partition.
+    Customers are disjoint across partitions, so customers and interactions add up, and only the product sets
+    need to be merged.
+    """
+    data = pd.read_csv(path, usecols=['CustomerID', 'ProductID', 'PurchaseAmount']).dropna(subset=['PurchaseAmount'])
+    amounts = data.groupby(['CustomerID', 'ProductID'])['PurchaseAmount'].sum()
+    return {
+        "rows": len(data),
+        "customers": data['CustomerID'].nunique(),
+        "products": np.unique(data['ProductID'].to_numpy(dtype=str)),
+        "nonzero": int(np.count_nonzero(amounts.to_numpy())),
+    }
+
+
+def calculate_partitioned_density(paths, workers=DEFAULT_PARTITION_WORKERS):
+    """
+    Calculate the density of the interaction matrix as a map-reduce job over the partitions of the purchase log.
+    """
+    results = map_partitions(density_partition, [(path,) for path in paths], workers)
+    add_rows(sum(r["rows"] for r in results))
+    num_products = len(np.unique(np.concatenate([r["products"] for r in results])))
+    cnt_all = sum(r["customers"] for r in results) * num_products
+    density = sum(r["nonzero"] for r in results) / cnt_all if cnt_all else 0.0
+    print(f"Matrix Density: {density:.4f}")
+    return density
+
+
+def run(partitioned=False, workers=DEFAULT_PARTITION_WORKERS):
+    if partitioned:
+        paths = partition_files()
+        if paths is None:
+            print("Partitioned dataset not found. Please run 'python3 cli.py repartition'.")
+            return
+        with profile_step("interaction_matrix"):
+            density = calculate_partitioned_density(paths, workers)
+    else:
+        with profile_step("csv_load"):
+            data = pd.read_csv(DATASET_PATH, usecols=['CustomerID', 'ProductID', 'PurchaseAmount'])
+            add_rows(len(data))
+        with profile_step("interaction_matrix"):
+            density = calculate_matrix_density(data, load_registry())
     if density > 0.5:
         print("The interaction matrix is dense.")
     elif density < 0.1:
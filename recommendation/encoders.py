@@ -0,0 +1,94 @@
+import hashlib
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from config import EMBEDDING_MODEL, DEFAULT_EMBEDDING_BATCH_SIZE, DEFAULT_EMBEDDING_WORKERS
+
+
+class SentenceTransformerEncoder:
+    """
+    Encodes texts with a pretrained Sentence Transformers model, optionally on a pool of worker processes.
+    """
+
+    def __init__(self, model_name=EMBEDDING_MODEL, batch_size=DEFAULT_EMBEDDING_BATCH_SIZE,
+                 num_workers=DEFAULT_EMBEDDING_WORKERS):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name)
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+
+    def encode(self, texts):
+        if self.num_workers <= 1:
+            return self.model.encode(texts, batch_size=self.batch_size, show_progress_bar=True)
+        pool = self.model.start_multi_process_pool(target_devices=["cpu"] * self.num_workers)
+        try:
+            return self.model.encode_multi_process(texts, pool, batch_size=self.batch_size)
+        finally:
+            self.model.stop_multi_process_pool(pool)
+
+
+def hash_encode(texts, dim):
+    embeddings = np.zeros((len(texts), dim), dtype=np.float32)
+    for i, text in enumerate(texts):
+        for word in text.split():
+            digest = int.from_bytes(hashlib.md5(word.encode()).digest()[:8], "little")
+            embeddings[i, digest % dim] += 1 if digest >> 63 else -1
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.where(norms == 0, 1, norms)
+
+
+class HashingEncoder:
+    """
+    Deterministic local stand-in for a Sentence Transformers model, used for tests, benchmarks and offline runs.
+    Each word is hashed to a signed position of a fixed-size vector.
+    """
+
+    def __init__(self, dim=384, batch_size=DEFAULT_EMBEDDING_BATCH_SIZE, num_workers=DEFAULT_EMBEDDING_WORKERS):
+        self.dim = dim
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+
+    def encode(self, texts):
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if self.num_workers <= 1 or len(batches) <= 1:
+            encoded = [hash_encode(batch, self.dim) for batch in batches]
+        else:
+            with Pool(self.num_workers) as pool:
+                encoded = pool.starmap(hash_encode, [(batch, self.dim) for batch in batches])
+        return np.vstack(encoded) if encoded else np.zeros((0, self.dim), dtype=np.float32)
+
+
+def load_encoder(model_name=EMBEDDING_MODEL, batch_size=DEFAULT_EMBEDDING_BATCH_SIZE,
+                 num_workers=DEFAULT_EMBEDDING_WORKERS):
+    """
+    Loads the embedding model, or the local stand-in encoder for model_name 'local-hashing'.
+    An encoder is any object with an encode(texts) method returning one embedding row per text.
+    """
+    if model_name == "local-hashing":
+        return HashingEncoder(batch_size=batch_size, num_workers=num_workers)
+    return SentenceTransformerEncoder(model_name, batch_size=batch_size, num_workers=num_workers)
+
+
+def encode_texts(encoder, texts):
+    """
+    Encodes texts with duplicates removed and the unique texts sorted by length,
+    so that each batch holds texts of similar length. Returns the embeddings in input order and encoding stats.
+    """
+    unique_texts, inverse = np.unique(np.asarray(texts, dtype=object), return_inverse=True)
+    by_length = np.argsort([len(text) for text in unique_texts], kind="stable")
+
+    start = time.perf_counter()
+    sorted_embeddings = np.asarray(encoder.encode(unique_texts[by_length].tolist()))
+    seconds = time.perf_counter() - start
+
+    unique_embeddings = np.empty_like(sorted_embeddings)
+    unique_embeddings[by_length] = sorted_embeddings
+    stats = {
+        "texts": len(texts),
+        "unique_texts": len(unique_texts),
+        "seconds": seconds,
+        "texts_per_second": len(texts) / seconds if seconds else float("inf"),
+    }
+    return unique_embeddings[inverse.ravel()], stats
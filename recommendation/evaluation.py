@@ -0,0 +1,218 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from config import DATASET_PATH, CLUSTER_OUTPUT_PATH, OUTPUT_PATH, EVALUATION_OUTPUT_PATH, DEFAULT_HOLDOUT_FRACTION, \
+    DEFAULT_EVALUATION_CONFIGS, DEFAULT_NUM_CANDIDATES
+from registry import load_registry
+from recommendation.content_based_filtering import recommend, load_files, product_rows, top_category_names
+from recommendation.candidates import build_candidates, encode_candidates, customer_candidates
+from recommendation.quantization import quantize, dequantize_rows, stored_nbytes
+from recommendation.sparse_similarity import keep_top_k
+from profiling import profile_step, add_rows
+
+
+def parse_config(spec):
+    """
+    Parses a recommender configuration: 'baseline', 'candidates', 'precision=<float64|float16|int8>', 'top_k=<K>',
+    or a combination joined by '+' (e.g. 'candidates+precision=int8').
+    Precision and top_k are applied to the prepared similarity matrix.
+    """
+    config = {"name": spec, "candidates": False, "precision": None, "top_k": None}
+    for part in spec.split("+"):
+        if part == "baseline":
+            continue
+        elif part == "candidates":
+            config["candidates"] = True
+        elif part.startswith("precision="):
+            config["precision"] = part.split("=", 1)[1]
+        elif part.startswith("top_k=") and part.split("=", 1)[1].isdigit():
+            config["top_k"] = int(part.split("=", 1)[1])
+        else:
+            raise ValueError(f"Invalid configuration '{part}'. "
+                             f"Valid configurations are baseline, candidates, precision=<precision> and top_k=<K>")
+    return config
+
+
+def configure_matrix(similarity_matrix, similarity_scales, precision=None, top_k=None):
+    """
+    Applies a configuration's top-k sparsification and storage precision to the prepared similarity matrix.
+    """
+    if precision is None and top_k is None:
+        return similarity_matrix, similarity_scales
+    if sparse.issparse(similarity_matrix):
+        scales = np.ones(similarity_matrix.shape[0], dtype=np.float32) if similarity_scales is None \
+            else similarity_scales
+        matrix = sparse.csr_matrix(sparse.diags(scales) @ similarity_matrix.astype(np.float32))
+    else:
+        matrix = dequantize_rows(similarity_matrix, similarity_scales, np.arange(similarity_matrix.shape[0]))
+    if top_k is not None:
+        matrix = keep_top_k(matrix, top_k)
+    return quantize(matrix, precision or "float64")
+
+
+def temporal_split(customers, dates, holdout_fraction=DEFAULT_HOLDOUT_FRACTION):
+    """
+    Splits each customer's purchases by date: the latest holdout_fraction of them (at least one) form the holdout,
+    the rest the history. Customers with a single purchase keep it in their history.
+    Returns a boolean holdout mask aligned with the purchases.
+    """
+    order = np.lexsort((dates, customers))
+    sorted_customers = customers[order]
+    starts = np.flatnonzero(np.r_[True, sorted_customers[1:] != sorted_customers[:-1]]) if len(order) else order
+    sizes = np.diff(np.r_[starts, len(order)])
+    position = np.arange(len(order)) - np.repeat(starts, sizes)
+    size = np.repeat(sizes, sizes)
+    num_holdout = np.where(size >= 2, np.maximum(1, np.floor(size * holdout_fraction)), 0)
+    holdout = np.zeros(len(order), dtype=bool)
+    holdout[order] = position >= size - num_holdout
+    return holdout
+
+
+def ranking_metrics(recommended, customers, relevant_keys, num_products, k):
+    """
+    Precision, recall and NDCG at k averaged over customers, and catalog coverage, computed over all customers at once.
+    recommended holds one row of product codes per customer (padded with -1), customers the sorted customer codes
+    of the rows, and relevant_keys the (customer code * num_products + product code) keys of the holdout products.
+    """
+    top = recommended[:, :k]
+    keys = customers[:, None].astype(np.int64) * num_products + top
+    hits = np.isin(keys, relevant_keys) & (top >= 0)
+    num_relevant = np.bincount(np.searchsorted(customers, relevant_keys // num_products), minlength=len(customers))
+
+    discounts = 1 / np.log2(np.arange(2, k + 2))
+    dcg = (hits * discounts[:top.shape[1]]).sum(axis=1)  # k may exceed the number of recommendation slots
+    ideal_dcg = np.r_[0, np.cumsum(discounts)][np.minimum(num_relevant, k)]
+    return {
+        f"precision@{k}": float((hits.sum(axis=1) / k).mean()),
+        f"recall@{k}": float((hits.sum(axis=1) / num_relevant).mean()),
+        f"ndcg@{k}": float((dcg / ideal_dcg).mean()),
+        "coverage": len(np.unique(top[top >= 0])) / num_products,
+    }
+
+
+def evaluate_config(config, similarity_matrix, similarity_scales, sm_rows, registry, customers, histories,
+                    candidates, top_c, top_n):
+    """
+    Recommends for every evaluated customer with one configuration.
+    Returns the recommended product codes (familiar ones first, then the novel one), per-customer latencies
+    in seconds, the total wall time and the stored size of the configured matrix.
+    """
+    matrix, scales = configure_matrix(similarity_matrix, similarity_scales, config["precision"], config["top_k"])
+    slots = top_c * top_n + 1
+    recommended = np.full((len(customers), slots), -1, dtype=np.int32)
+    latencies = np.empty(len(customers))
+
+    start = time.perf_counter()
+    for i, (code, purchases) in enumerate(zip(customers, histories)):
+        request_start = time.perf_counter()
+        candidate_codes = customer_candidates(candidates, str(registry.customer_ids[code]),
+                                              top_category_names(purchases, registry, top_c)) \
+            if config["candidates"] else None
+        _, familiar_recommendations, best_match = recommend(purchases, matrix, sm_rows, registry, top_c=top_c,
+                                                            top_n=top_n, candidates=candidate_codes,
+                                                            similarity_scales=scales)
+        latencies[i] = time.perf_counter() - request_start
+        m = min(len(familiar_recommendations), slots - 1)
+        recommended[i, :m] = familiar_recommendations[:m]
+        recommended[i, m] = best_match
+    return recommended, latencies, time.perf_counter() - start, stored_nbytes(matrix)
+
+
+def run(configs=DEFAULT_EVALUATION_CONFIGS, holdout_fraction=DEFAULT_HOLDOUT_FRACTION, k=None, top_c=2, top_n=3,
+        num_candidates=DEFAULT_NUM_CANDIDATES):
+    """
+    Evaluates recommender configurations on a temporal holdout of every customer's purchases,
+    reporting ranking quality next to throughput and latency.
+    """
+    try:
+        configs = [parse_config(spec) for spec in configs]
+    except ValueError as e:
+        print(e)
+        return
+    k = k or top_c * top_n + 1
+
+    with profile_step("csv_load"):
+        data = pd.read_csv(DATASET_PATH)
+        add_rows(len(data))
+    try:
+        with profile_step("artifact_load"):
+            similarity_matrix, similarity_scales, similarity_products = load_files()
+    except FileNotFoundError as e:
+        print(e)
+        return
+    registry = load_registry()
+    sm_rows = product_rows(registry, similarity_products)
+
+    with profile_step("split"):
+        customers = registry.encode_customers(data['CustomerID'])
+        products = registry.encode_products(data['ProductID'])
+        dates = pd.to_datetime(data['PurchaseDate']).to_numpy().astype(np.int64)
+        holdout = temporal_split(customers, dates, holdout_fraction)
+        valid = (customers >= 0) & (products >= 0)
+
+        # Relevant products: bought in the holdout period but not before
+        keys = customers.astype(np.int64) * registry.num_products + products
+        relevant_keys = np.setdiff1d(keys[holdout & valid], keys[~holdout & valid])
+        eval_customers = np.unique(relevant_keys // registry.num_products).astype(np.int32)
+
+        # Purchase histories of the evaluated customers, in purchase log order
+        history_idx = np.flatnonzero(~holdout & valid)
+        history_idx = history_idx[np.argsort(customers[history_idx], kind='stable')]
+        history_customers = customers[history_idx]
+        starts = np.searchsorted(history_customers, eval_customers, side='left')
+        ends = np.searchsorted(history_customers, eval_customers, side='right')
+        histories = [products[history_idx[s:e]] for s, e in zip(starts, ends)]
+    if not len(eval_customers):
+        print("No customer bought new products in the holdout period. Nothing to evaluate.")
+        return
+    print(f"Evaluating {len(eval_customers)} customers with {len(relevant_keys)} holdout products "
+          f"(holdout fraction {holdout_fraction}, k={k}).")
+
+    candidates = None
+    if any(config["candidates"] for config in configs):
+        try:
+            clustered_data = pd.read_csv(CLUSTER_OUTPUT_PATH / "clustered_data.csv")
+        except FileNotFoundError:
+            print("Error: 'clustered_data.csv' not found. Skipping candidate configurations.")
+            configs = [config for config in configs if not config["candidates"]]
+        else:
+            # Candidates are built from the history only, so they do not leak holdout purchases
+            candidates = encode_candidates(build_candidates(data[~holdout], clustered_data, num_candidates), registry)
+
+    results = []
+    for config in configs:
+        try:
+            with profile_step("scoring"):
+                recommended, latencies, seconds, matrix_bytes = evaluate_config(
+                    config, similarity_matrix, similarity_scales, sm_rows, registry, eval_customers, histories,
+                    candidates, top_c, top_n)
+                add_rows(len(eval_customers))
+        except ValueError as e:
+            print(f"Skipping configuration '{config['name']}': {e}")
+            continue
+        with profile_step("metrics"):
+            metrics = ranking_metrics(recommended, eval_customers, relevant_keys, registry.num_products, k)
+        results.append({
+            "config": config["name"],
+            **metrics,
+            "customers/s": len(eval_customers) / seconds if seconds else float("inf"),
+            "latency_p50_ms": float(np.percentile(latencies, 50) * 1000) if len(latencies) else 0.0,
+            "latency_p95_ms": float(np.percentile(latencies, 95) * 1000) if len(latencies) else 0.0,
+            "latency_p99_ms": float(np.percentile(latencies, 99) * 1000) if len(latencies) else 0.0,
+            "matrix_mb": matrix_bytes / 2 ** 20,
+        })
+
+    report = pd.DataFrame(results)
+    print(report.to_string(index=False, float_format="%.4f"))
+    if not os.path.exists(OUTPUT_PATH):
+        os.makedirs(OUTPUT_PATH)
+    report.to_csv(EVALUATION_OUTPUT_PATH, index=False)
+    print("Evaluation done! Results are saved at ", EVALUATION_OUTPUT_PATH)
+
+
+if __name__ == "__main__":
+    run()
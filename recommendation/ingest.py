@@ -0,0 +1,56 @@
+import os
+
+import pandas as pd
+
+from config import DATASET_PATH
+from recommendation.popularity import load_popularity, save_popularity, update_popularity
+from recommendation.customer_index import CUSTOMER_INDEX_PATH, run as rebuild_customer_index
+from recommendation.cache import open_cache
+from sales_cube import load_manifest, update_cube
+from partitions import load_partition_manifest, append_partitions, save_partition_manifest, partition_file
+
+
+def run(purchases_path):
+    """
+    Append new purchase records to the dataset and incrementally refresh the precomputed recommendation data.
+    If the purchase log is only kept as partitions, the records are appended to the partitions alone.
+    """
+    try:
+        new_data = pd.read_csv(purchases_path)
+    except FileNotFoundError:
+        print(f"Purchase file not found at {purchases_path}.")
+        return
+    manifest = load_partition_manifest()
+    if not os.path.exists(DATASET_PATH) and manifest is None:
+        print("Dataset not found.")
+        return
+
+    # Append to the dataset with the dataset's (or the partitions') column order
+    if os.path.exists(DATASET_PATH):
+        columns = pd.read_csv(DATASET_PATH, nrows=0).columns
+        new_data[columns].to_csv(DATASET_PATH, mode="a", header=False, index=False)
+        print(f"Appended {len(new_data)} purchase records to {DATASET_PATH}")
+    else:
+        columns = pd.read_csv(partition_file(0), nrows=0).columns
+
+    if manifest is not None:
+        save_partition_manifest(append_partitions(new_data[columns], manifest))
+        print("Partitioned dataset refreshed.")
+
+    table = load_popularity()
+    if table is not None:
+        save_popularity(update_popularity(table, new_data))
+        print("Popularity table refreshed.")
+
+    # The index is stale now that the dataset changed, so check for its file rather than loading it
+    if os.path.exists(CUSTOMER_INDEX_PATH) and os.path.exists(DATASET_PATH):
+        rebuild_customer_index()
+
+    if load_manifest() is not None:
+        update_cube(new_data)
+        print("Sales cube refreshed.")
+
+    # Drop cached recommendations of the customers who purchased something new
+    cache = open_cache()
+    cache.invalidate(new_data['CustomerID'].unique())
+    cache.close()
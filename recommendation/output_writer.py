@@ -0,0 +1,128 @@
+import csv
+import importlib.util
+
+import numpy as np
+
+OUTPUT_FORMATS = ["csv", "parquet"]
+
+
+def output_format_available(output_format):
+    """
+    Parquet output needs pyarrow (or fastparquet), which is not a required dependency.
+    """
+    if output_format == "parquet":
+        return any(importlib.util.find_spec(name) for name in ["pyarrow", "fastparquet"])
+    return output_format in OUTPUT_FORMATS
+
+
+def decode(values, codes):
+    """
+    Decodes registry codes to a string array, with missing values for code -1.
+    """
+    import pandas as pd
+    return pd.array(np.where(codes >= 0, values[codes], None), dtype="string")
+
+
+class RecommendationWriter:
+    """
+    Collects recommendation results as registry codes into preallocated arrays,
+    and decodes and writes them in a single block.
+
+    The wide format has one row per customer with a fixed number of familiar recommendation slots
+    (CustomerID, RecID01, RecDesc01, RecScore01, ..., NovelRecID, NovelRecDesc, NovelRecScore),
+    left empty when a customer has fewer recommendations, so the schema does not depend on the data.
+    The long format has one row per recommendation (CustomerID, Rank, ProductID, Score, Kind),
+    with Kind 'familiar' or 'novel' and Rank starting at 1 within each kind.
+    """
+
+    def __init__(self, num_customers, num_familiar, output_format="csv", long_format=False):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Invalid output format '{output_format}'. "
+                             f"Valid formats are {', '.join(OUTPUT_FORMATS)}")
+        self.output_format = output_format
+        self.long_format = long_format
+        self.num_familiar = num_familiar
+        self.size = 0
+        self.customers = np.full(num_customers, -1, dtype=np.int32)
+        self.familiar_codes = np.full((num_customers, num_familiar), -1, dtype=np.int32)
+        self.familiar_scores = np.full((num_customers, num_familiar), np.nan, dtype=np.float32)
+        self.novel_codes = np.full(num_customers, -1, dtype=np.int32)
+        self.novel_scores = np.full(num_customers, np.nan, dtype=np.float32)
+
+    def add(self, customer_code, familiar_codes, familiar_scores, novel_code, novel_score):
+        i = self.size
+        m = min(len(familiar_codes), self.num_familiar)
+        self.customers[i] = customer_code
+        self.familiar_codes[i, :m] = familiar_codes[:m]
+        self.familiar_scores[i, :m] = familiar_scores[:m]
+        self.novel_codes[i] = novel_code
+        if novel_code >= 0:
+            self.novel_scores[i] = novel_score
+        self.size += 1
+
+    def to_frame(self, registry):
+        import pandas as pd
+        n = self.size
+        customer_ids = decode(registry.customer_ids, self.customers[:n])
+        if self.long_format:
+            # One slot per familiar recommendation followed by the novel one, for each customer
+            slots = self.num_familiar + 1
+            codes = np.column_stack([self.familiar_codes[:n], self.novel_codes[:n]]).ravel()
+            filled = codes >= 0
+            return pd.DataFrame({
+                "CustomerID": customer_ids[np.repeat(np.arange(n), slots)[filled]],
+                "Rank": np.tile(np.r_[np.arange(1, slots), 1], n)[filled].astype(np.int32),
+                "ProductID": decode(registry.product_ids, codes[filled]),
+                "Score": np.column_stack([self.familiar_scores[:n], self.novel_scores[:n]]).ravel()[filled],
+                "Kind": pd.array(np.tile(["familiar"] * (slots - 1) + ["novel"], n)[filled], dtype="string"),
+            })
+
+        descriptions = registry.descriptions[registry.product_descriptions]  # Per product code
+        columns = {"CustomerID": customer_ids}
+        for i in range(self.num_familiar):
+            codes = self.familiar_codes[:n, i]
+            columns[f"RecID{i + 1:02d}"] = decode(registry.product_ids, codes)
+            columns[f"RecDesc{i + 1:02d}"] = decode(descriptions, codes)
+            columns[f"RecScore{i + 1:02d}"] = self.familiar_scores[:n, i]
+        columns["NovelRecID"] = decode(registry.product_ids, self.novel_codes[:n])
+        columns["NovelRecDesc"] = decode(descriptions, self.novel_codes[:n])
+        columns["NovelRecScore"] = self.novel_scores[:n]
+        return pd.DataFrame(columns)
+
+    def write(self, path, registry):
+        frame = self.to_frame(registry)
+        if self.output_format == "parquet":
+            frame.to_parquet(path, index=False)
+        else:
+            frame.to_csv(path, index=False, float_format="%.6g")
+        return len(frame)
+
+    def write_csv(self, path, registry):
+        """
+        Writes the wide format as CSV with the csv module instead of pandas,
+        for the few rows of single-customer requests on the serving fast path.
+        """
+        descriptions = registry.descriptions[registry.product_descriptions]
+
+        def cells(values, code, score):
+            return ["", "", ""] if code < 0 else [values[code], descriptions[code], f"{score:.6g}"]
+
+        header = ["CustomerID"]
+        for i in range(self.num_familiar):
+            header += [f"RecID{i + 1:02d}", f"RecDesc{i + 1:02d}", f"RecScore{i + 1:02d}"]
+        header += ["NovelRecID", "NovelRecDesc", "NovelRecScore"]
+
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(header)
+            for i in range(self.size):
+                row = [registry.customer_ids[self.customers[i]] if self.customers[i] >= 0 else ""]
+                for j in range(self.num_familiar):
+                    row += cells(registry.product_ids, self.familiar_codes[i, j], self.familiar_scores[i, j])
+                row += cells(registry.product_ids, self.novel_codes[i], self.novel_scores[i])
+                writer.writerow(row)
+        return self.size
+
+
+def output_file_name(name, output_format="csv", long_format=False):
+    return f"{name}{'_long' if long_format else ''}.{output_format}"
@@ -0,0 +1,150 @@
+import os
+
+import numpy as np
+import pickle
+
+from config import DATASET_PATH, RECOMMENDATION_TEMP_PATH, DEFAULT_HALF_LIFE_DAYS
+
+
+def decay_weights(purchase_dates, reference_date, half_life_days):
+    """
+    Exponential time decay of each purchase: 1 at the reference date, 0.5 after half_life_days.
+    """
+    age_days = (reference_date - purchase_dates).dt.days.to_numpy()
+    return np.exp(-np.log(2) * age_days / half_life_days)
+
+
+def to_sorted_array(scores):
+    """
+    Converts a popularity series indexed by ProductID to a (pids, scores) pair of arrays sorted by score.
+    """
+    scores = scores.sort_values(ascending=False, kind="stable")
+    return scores.index.to_numpy(dtype=str), scores.to_numpy(dtype=np.float32)
+
+
+def merge_sorted_array(ranking, new_scores, factor):
+    """
+    Decays an existing (pids, scores) ranking by factor, adds new_scores (a series indexed by ProductID) and re-sorts.
+    The cost depends on the number of products only, not on the number of purchases.
+    """
+    import pandas as pd
+    pids, scores = ranking
+    merged = pd.Series(scores * factor, index=pids).add(new_scores, fill_value=0)
+    return to_sorted_array(merged)
+
+
+def aggregate(data, weights, by_month):
+    """
+    Sums purchase weights globally, per category and (optionally) per month.
+    """
+    data = data.assign(Weight=weights)
+    global_scores = data.groupby('ProductID')['Weight'].sum()
+    category_scores = {
+        category: group.groupby('ProductID')['Weight'].sum()
+        for category, group in data.groupby('ProductCategory')
+    }
+    month_scores = {}
+    if by_month:
+        months = data['PurchaseDate'].dt.strftime('%Y-%m')
+        month_scores = {
+            month: group.groupby('ProductID')['Weight'].sum()
+            for month, group in data.groupby(months)
+        }
+    return global_scores, category_scores, month_scores
+
+
+def build_popularity(data, half_life_days=DEFAULT_HALF_LIFE_DAYS, by_month=False):
+    """
+    Materialises time-decayed product popularity, globally, per category and optionally per month,
+    as arrays sorted by popularity score.
+    The table holds only NumPy arrays and builtins, so loading it does not import pandas, and its size depends
+    on the number of products only. Product descriptions are looked up in the registry.
+    """
+    import pandas as pd
+    data = data.assign(PurchaseDate=pd.to_datetime(data['PurchaseDate']))
+    reference_date = data['PurchaseDate'].max()
+    weights = decay_weights(data['PurchaseDate'], reference_date, half_life_days)
+    global_scores, category_scores, month_scores = aggregate(data, weights, by_month)
+
+    return {
+        "reference_date": reference_date.to_datetime64(),
+        "half_life_days": half_life_days,
+        "by_month": by_month,
+        "global": to_sorted_array(global_scores),
+        "category": {category: to_sorted_array(scores) for category, scores in category_scores.items()},
+        "month": {month: to_sorted_array(scores) for month, scores in month_scores.items()},
+    }
+
+
+def update_popularity(table, new_data):
+    """
+    Incrementally refreshes the popularity table with newly appended purchases.
+    Existing scores are decayed to the new reference date before the new purchases are added.
+    """
+    import pandas as pd
+    new_data = new_data.assign(PurchaseDate=pd.to_datetime(new_data['PurchaseDate']))
+    previous_date = pd.Timestamp(table["reference_date"])
+    reference_date = max(previous_date, new_data['PurchaseDate'].max())
+    half_life_days = table["half_life_days"]
+    factor = np.float32(np.exp(-np.log(2) * (reference_date - previous_date).days / half_life_days))
+    weights = decay_weights(new_data['PurchaseDate'], reference_date, half_life_days)
+    global_scores, category_scores, month_scores = aggregate(new_data, weights, table["by_month"])
+
+    empty = (np.array([], dtype=str), np.array([], dtype=np.float32))
+    table["global"] = merge_sorted_array(table["global"], global_scores, factor)
+    for category, scores in category_scores.items():
+        table["category"][category] = merge_sorted_array(table["category"].get(category, empty), scores, factor)
+    for month in table["month"]:
+        table["month"][month] = (table["month"][month][0], table["month"][month][1] * factor)
+    for month, scores in month_scores.items():
+        table["month"][month] = merge_sorted_array(table["month"].get(month, empty), scores, 1)
+    table["reference_date"] = reference_date.to_datetime64()
+    return table
+
+
+def top_popular(table, k=5, category=None, month=None):
+    """
+    Returns the k most popular (ProductID, score) pairs, globally or within a category or month.
+    """
+    if category is not None:
+        pids, scores = table["category"].get(category, ([], []))
+    elif month is not None:
+        pids, scores = table["month"].get(month, ([], []))
+    else:
+        pids, scores = table["global"]
+    return list(zip(pids[:k], scores[:k]))
+
+
+def load_popularity():
+    """
+    Loads the popularity table, or returns None if it has not been built.
+    """
+    if not os.path.exists(RECOMMENDATION_TEMP_PATH / "popularity.pkl"):
+        return None
+    with open(RECOMMENDATION_TEMP_PATH / "popularity.pkl", "rb") as f:
+        return pickle.load(f)
+
+
+def save_popularity(table):
+    if not os.path.exists(RECOMMENDATION_TEMP_PATH):
+        os.makedirs(RECOMMENDATION_TEMP_PATH)
+    with open(RECOMMENDATION_TEMP_PATH / "popularity.pkl", "wb") as f:
+        pickle.dump(table, f)
+
+
+def run(half_life_days=DEFAULT_HALF_LIFE_DAYS, by_month=False):
+    import pandas as pd
+    try:
+        data = pd.read_csv(DATASET_PATH)
+    except FileNotFoundError:
+        print("Dataset not found.")
+        return
+
+    table = build_popularity(data, half_life_days, by_month)
+    save_popularity(table)
+    print(f"Popularity table with a {half_life_days}-day half-life saved at "
+          f"{RECOMMENDATION_TEMP_PATH / 'popularity.pkl'}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,108 @@
+import numpy as np
+
+from recommendation.sparse_similarity import top_k_mask, is_sparse
+
+PRECISIONS = ["float64", "float16", "int8"]
+SPARSE_PRECISIONS = ["float64", "int8"]  # scipy.sparse does not support float16
+
+
+def quantize(matrix, precision="float64"):
+    """
+    Converts a matrix to the storage precision. Returns the stored matrix and its per-row scales.
+    int8 uses symmetric per-row quantization calibrated on the row's largest absolute value:
+    a row is stored as round(row / scale) with scale = max(|row|) / 127. Other precisions have no scales.
+    Sparse (CSR) matrices keep their sparsity pattern and only have their stored values converted.
+    """
+    if is_sparse(matrix):
+        return quantize_sparse(matrix.tocsr(), precision)
+    if precision == "float64":
+        return np.asarray(matrix, dtype=np.float64), None
+    if precision == "float16":
+        return np.asarray(matrix, dtype=np.float16), None
+    if precision == "int8":
+        matrix = np.asarray(matrix, dtype=np.float32)
+        scales = np.abs(matrix).max(axis=1) / 127
+        scales[scales == 0] = 1
+        quantized = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return quantized, scales.astype(np.float32)
+    raise ValueError(f"Invalid precision '{precision}'. Valid precisions are {', '.join(PRECISIONS)}")
+
+
+def quantize_sparse(matrix, precision):
+    from scipy import sparse
+    if precision == "float64":
+        return matrix.astype(np.float64), None
+    if precision == "int8":
+        scales = abs(matrix).max(axis=1).toarray().ravel().astype(np.float32) / 127
+        scales[scales == 0] = 1
+        rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+        data = np.clip(np.rint(matrix.data / scales[rows]), -127, 127).astype(np.int8)
+        quantized = sparse.csr_matrix((data, matrix.indices.copy(), matrix.indptr.copy()), shape=matrix.shape)
+        return quantized, scales
+    raise ValueError(f"Invalid precision '{precision}' for a sparse matrix. "
+                     f"Valid precisions are {', '.join(SPARSE_PRECISIONS)}")
+
+
+def stored_nbytes(matrix):
+    """
+    Bytes taken by a stored matrix; for sparse matrices, its values and index arrays.
+    """
+    if is_sparse(matrix):
+        return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    return matrix.nbytes
+
+
+def dequantize_rows(matrix, scales, rows, columns=None):
+    """
+    Gathers the given rows (and columns) of a stored matrix as float32, applying the int8 scales if any.
+    Only the gathered block is converted, so the full matrix stays in its compact storage type.
+    For sparse matrices, the gathered block is returned dense, with zeros outside each row's stored neighbours.
+    """
+    if is_sparse(matrix):
+        block = matrix[rows] if columns is None else matrix[rows][:, columns]
+        block = block.toarray().astype(np.float32)
+    else:
+        block = matrix[rows] if columns is None else matrix[np.ix_(rows, columns)]
+        block = block.astype(np.float32)
+    if scales is not None:
+        block *= scales[rows, None]
+    return block
+
+
+def neighbour_overlap(reference, matrix, scales, k=10):
+    """
+    Mean overlap@k between each row's top-k neighbours in the reference matrix and in the stored matrix.
+    1.0 means the reduced precision ranks the same k nearest neighbours for every product.
+    """
+    if is_sparse(reference):
+        return sparse_neighbour_overlap(reference.tocsr(), matrix, scales, k)
+    k = min(k, reference.shape[1])
+    rows = np.arange(reference.shape[0])
+    reference_top = np.argpartition(-reference, k - 1, axis=1)[:, :k]
+    stored_top = np.argpartition(-dequantize_rows(matrix, scales, rows), k - 1, axis=1)[:, :k]
+    overlaps = [len(np.intersect1d(a, b)) / k for a, b in zip(reference_top, stored_top)]
+    return float(np.mean(overlaps))
+
+
+def sparse_neighbour_overlap(reference, matrix, scales, k=10):
+    """
+    neighbour_overlap for sparse matrices, comparing the top-k among each row's stored neighbours.
+    Rows without stored neighbours are ignored.
+    """
+    n = reference.shape[0]
+    counts = np.minimum(np.diff(reference.indptr), k)
+    if not counts.any():
+        return 1.0
+    rows = np.repeat(np.arange(n), np.diff(reference.indptr))
+
+    stored_values = matrix.data.astype(np.float32)
+    if scales is not None:
+        stored_values *= scales[np.repeat(np.arange(n), np.diff(matrix.indptr))]
+
+    top_pairs = []
+    for values, cols in [(reference.data, reference.indices), (stored_values, matrix.indices)]:
+        top_rows, top_cols, _, keep = top_k_mask(rows, cols, values, k)
+        top_pairs.append(top_rows[keep].astype(np.int64) * n + top_cols[keep])
+    matches = np.intersect1d(*top_pairs) // n
+    overlaps = np.bincount(matches, minlength=n)[counts > 0] / counts[counts > 0]
+    return float(np.mean(overlaps))
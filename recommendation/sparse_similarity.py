@@ -0,0 +1,83 @@
+import sys
+
+import numpy as np
+
+from config import SPARSE_SIMILARITY_THRESHOLD, SPARSE_BLOCK_SIZE
+
+
+def is_sparse(matrix):
+    """
+    Whether matrix is a scipy sparse matrix. scipy is only loaded once a sparse matrix was created or unpickled,
+    so dense code paths never import it.
+    """
+    scipy_sparse = sys.modules.get("scipy.sparse")
+    return scipy_sparse is not None and scipy_sparse.issparse(matrix)
+
+
+def top_k_mask(rows, cols, values, k):
+    """
+    Orders (row, col, value) entries by row, then by descending value (ties by column),
+    and returns them with a mask selecting the first k entries of each row.
+    """
+    order = np.lexsort((cols, -values, rows))
+    rows, cols, values = rows[order], cols[order], values[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    return rows, cols, values, rank < k
+
+
+def to_csr(kept_rows, kept_cols, kept_values, shape):
+    from scipy import sparse
+    rows = np.concatenate(kept_rows) if kept_rows else np.array([], dtype=np.int64)
+    cols = np.concatenate(kept_cols) if kept_cols else np.array([], dtype=np.int64)
+    values = np.concatenate(kept_values) if kept_values else np.array([], dtype=np.float32)
+    return sparse.csr_matrix((values, (rows, cols)), shape=shape, dtype=np.float32)
+
+
+def top_k_similarity(matrix, top_k, threshold=SPARSE_SIMILARITY_THRESHOLD, block_size=SPARSE_BLOCK_SIZE):
+    """
+    Sparse cosine similarity keeping only the top_k most similar other products of each row.
+    matrix holds one L2-normalized row per product (e.g. TF-IDF vectors).
+
+    Rows are multiplied by the transposed matrix in blocks of block_size. scipy builds each block's product in full,
+    so peak memory is one block_size x N product (at most block_size * N similarities) on top of the result.
+    Right after each product, similarities below threshold are dropped and only the top_k of each row are kept,
+    so the result holds at most N * top_k entries and the N x N matrix is never built.
+    Returns a float32 CSR matrix without the diagonal.
+    """
+    from scipy import sparse
+    matrix = sparse.csr_matrix(matrix, dtype=np.float32)
+    transposed = matrix.T.tocsr()
+    n = matrix.shape[0]
+    kept_rows, kept_cols, kept_values = [], [], []
+
+    for start in range(0, n, block_size):
+        block = (matrix[start:start + block_size] @ transposed).tocsr()
+        rows = np.repeat(np.arange(block.shape[0]), np.diff(block.indptr))
+        keep = (block.data >= threshold) & (block.indices != rows + start)
+        rows, cols, values = rows[keep], block.indices[keep], block.data[keep]
+        del block  # Free the block's product before sorting what is left of it
+        rows, cols, values, keep = top_k_mask(rows, cols, values, top_k)
+        kept_rows.append(rows[keep] + start)
+        kept_cols.append(cols[keep])
+        kept_values.append(values[keep])
+
+    return to_csr(kept_rows, kept_cols, kept_values, (n, n))
+
+
+def keep_top_k(similarity, top_k, block_size=SPARSE_BLOCK_SIZE):
+    """
+    Keeps the top_k largest similarities of each row of a dense or sparse similarity matrix, without the diagonal.
+    Rows are processed in blocks of block_size. Returns a float32 CSR matrix.
+    """
+    from scipy import sparse
+    n = similarity.shape[0]
+    kept_rows, kept_cols, kept_values = [], [], []
+    for start in range(0, n, block_size):
+        block = sparse.coo_matrix(similarity[start:start + block_size])
+        keep = block.row + start != block.col
+        rows, cols, values, keep = top_k_mask(block.row[keep], block.col[keep], block.data[keep], top_k)
+        kept_rows.append(rows[keep] + start)
+        kept_cols.append(cols[keep])
+        kept_values.append(values[keep])
+
+    return to_csr(kept_rows, kept_cols, kept_values, similarity.shape)
@@ -0,0 +1,149 @@
+import os
+
+import numpy as np
+
+from config import PRODUCTS_PATH, DATASET_PATH, REGISTRY_PATH
+
+
+def lookup(sorted_values, values, order=None):
+    """
+    Binary search of values in a sorted array. Returns their positions (mapped through order if given) as int32,
+    or -1 for values that are not found.
+    """
+    values = np.asarray(values, dtype=str)
+    if not len(sorted_values):
+        return np.full(len(values), -1, dtype=np.int32)
+    positions = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    codes = positions if order is None else order[positions]
+    return np.where(sorted_values[positions] == values, codes, -1).astype(np.int32)
+
+
+class Registry:
+    """
+    Dense int32 codes for the product and customer IDs and the repeated category and description strings.
+
+    Products are coded in catalog (products.csv) order and customers in sorted order. Each product's category
+    and description are stored as codes into the category and description vocabularies.
+    Modules work on codes and decode them to strings only when writing output. Unknown IDs encode to -1.
+    Lookups are binary searches over sorted arrays, so loading the registry needs neither pandas nor hash tables.
+    """
+
+    def __init__(self, product_ids, product_categories, product_descriptions, categories, descriptions,
+                 customer_ids, product_order=None):
+        self.product_ids = product_ids
+        self.product_categories = product_categories
+        self.product_descriptions = product_descriptions
+        self.categories = categories  # Sorted
+        self.descriptions = descriptions
+        self.customer_ids = customer_ids  # Sorted
+        self.product_order = np.argsort(product_ids, kind="stable") if product_order is None else product_order
+        self.sorted_product_ids = product_ids[self.product_order]
+
+    @classmethod
+    def build(cls, products, customer_ids):
+        import pandas as pd
+        category_codes, categories = pd.factorize(products['ProductCategory'], sort=True)
+        description_codes, descriptions = pd.factorize(products['ProductDescription'].fillna(""))
+        return cls(
+            products['ProductID'].to_numpy(dtype=str),
+            category_codes.astype(np.int32),
+            description_codes.astype(np.int32),
+            np.asarray(categories, dtype=str),
+            np.asarray(descriptions, dtype=str),
+            np.unique(np.asarray(customer_ids, dtype=str)),
+        )
+
+    @property
+    def num_products(self):
+        return len(self.product_ids)
+
+    @property
+    def num_customers(self):
+        return len(self.customer_ids)
+
+    @property
+    def num_categories(self):
+        return len(self.categories)
+
+    def encode_products(self, pids):
+        return lookup(self.sorted_product_ids, pids, self.product_order)
+
+    def encode_customers(self, cids):
+        return lookup(self.customer_ids, cids)
+
+    def encode_categories(self, names):
+        return lookup(self.categories, names)
+
+    def with_customers(self, customer_ids):
+        """
+        A registry with the same products and categories but only the given customers,
+        e.g. the customers of one partition of the purchase log.
+        """
+        return Registry(self.product_ids, self.product_categories, self.product_descriptions, self.categories,
+                        self.descriptions, np.unique(np.asarray(customer_ids, dtype=str)), self.product_order)
+
+    def describe(self, product_codes):
+        """
+        Descriptions of the given product codes.
+        """
+        return self.descriptions[self.product_descriptions[product_codes]]
+
+    def category_names(self, product_codes):
+        """
+        Category names of the given product codes.
+        """
+        return self.categories[self.product_categories[product_codes]]
+
+    def save(self, path=REGISTRY_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so that concurrent pipeline stages never read a partial registry
+        temp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(temp_path, product_ids=self.product_ids, product_categories=self.product_categories,
+                 product_descriptions=self.product_descriptions, categories=self.categories,
+                 descriptions=self.descriptions, customer_ids=self.customer_ids, product_order=self.product_order)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path=REGISTRY_PATH, customers=True):
+        """
+        Loads a saved registry. Without customers, the customer IDs are not read from the file
+        (members of the archive are only read when accessed) and the registry knows no customers.
+        """
+        with np.load(path) as f:
+            customer_ids = f['customer_ids'] if customers else np.array([], dtype=str)
+            return cls(f['product_ids'], f['product_categories'], f['product_descriptions'], f['categories'],
+                       f['descriptions'], customer_ids, f['product_order'] if 'product_order' in f.files else None)
+
+
+def is_stale(path=REGISTRY_PATH, sources=(PRODUCTS_PATH, DATASET_PATH)):
+    if not os.path.exists(path):
+        return True
+    mtime = os.stat(path).st_mtime_ns
+    return any(os.path.exists(source) and os.stat(source).st_mtime_ns > mtime for source in sources)
+
+
+def load_registry():
+    """
+    Loads the registry, rebuilding it from the product catalog and the purchase log if either changed since.
+    """
+    if not is_stale():
+        return Registry.load()
+    import pandas as pd
+    products = pd.read_csv(PRODUCTS_PATH)
+    customer_ids = pd.read_csv(DATASET_PATH, usecols=['CustomerID'])['CustomerID'] \
+        if os.path.exists(DATASET_PATH) else []
+    registry = Registry.build(products, customer_ids)
+    registry.save()
+    return registry
+
+
+def load_product_registry():
+    """
+    Loads the product side of the registry only, for callers that do not need customer codes.
+    Neither the customer IDs nor the purchase log are read: if the product catalog changed since the registry
+    was saved, the product codes are rebuilt from the catalog alone.
+    """
+    if not is_stale(REGISTRY_PATH, (PRODUCTS_PATH,)):
+        return Registry.load(customers=False)
+    import pandas as pd
+    return Registry.build(pd.read_csv(PRODUCTS_PATH), [])
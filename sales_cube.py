@@ -0,0 +1,349 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from config import DATASET_PATH, CUBE_PATH, CUBE_MANIFEST_PATH, CUBE_SKETCH_PRECISION
+from registry import is_stale
+from profiling import profile_step, add_rows
+
+GRANULARITIES = ["day", "week", "month", "year"]
+CELL_COLUMNS = ["date", "category", "product", "description", "amount", "count"]
+SKETCH_COLUMNS = ["sketch_date", "sketch_category", "sketch_registers"]
+
+
+def customer_hashes(customer_ids):
+    """
+    64-bit hashes of customer IDs. They depend on the IDs only, so sketches of different builds can be merged.
+    """
+    unique_ids, inverse = np.unique(np.asarray(customer_ids, dtype=str), return_inverse=True)
+    hashes = np.array([int.from_bytes(hashlib.blake2b(cid.encode(), digest_size=8).digest(), "little")
+                       for cid in unique_ids], dtype=np.uint64)
+    return hashes[inverse]
+
+
+def bit_length(values):
+    """
+    Number of significant bits of each uint64 value.
+    """
+    values = values.copy()
+    length = np.zeros(len(values), dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = (values >> np.uint64(shift)) > 0
+        length[high] += shift
+        values[high] >>= np.uint64(shift)
+    return length + (values > 0)
+
+
+def sketch(hashes, groups, num_groups, precision=CUBE_SKETCH_PRECISION):
+    """
+    HyperLogLog sketches of the hashed customers of each group, as (num_groups, 2^precision) uint8 registers.
+    The first precision bits of a hash select a register, which keeps the highest rank
+    (position of the first 1 bit) of the remaining bits. Sketches merge by taking the register-wise maximum.
+    """
+    bits = 64 - precision
+    registers = np.zeros((num_groups, 1 << precision), dtype=np.uint8)
+    index = (hashes >> np.uint64(bits)).astype(np.int64)
+    rank = bits + 1 - bit_length(hashes & np.uint64((1 << bits) - 1)).astype(np.int64)
+    np.maximum.at(registers, (groups, index), rank.astype(np.uint8))
+    return registers
+
+
+def estimate(registers):
+    """
+    Distinct count estimated from each row of HyperLogLog registers, using linear counting for small counts.
+    """
+    registers = np.atleast_2d(registers)
+    m = registers.shape[1]
+    alpha = 0.7213 / (1 + 1.079 / m)
+    raw = alpha * m * m / np.exp2(-registers.astype(np.float64)).sum(axis=1)
+    zeros = np.count_nonzero(registers == 0, axis=1)
+    linear = m * np.log(m / np.maximum(zeros, 1))
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+def group_keys(keys):
+    """
+    Sorted unique keys with the position of each key among them.
+    """
+    return np.unique(keys, return_inverse=True)
+
+
+def merge_sketches(keys, registers):
+    """
+    Merges the sketches sharing a key. Returns the sorted unique keys and their merged registers.
+    """
+    if not len(keys):
+        return keys, registers
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[starts], np.maximum.reduceat(registers[order], starts, axis=0)
+
+
+def aggregate(columns):
+    """
+    Builds a cube partition from decoded columns: amounts and counts are summed per (date, category, product) cell
+    and sketches are merged per (date, category). Categories and products are dictionary-encoded
+    and every column is stored as its own array.
+    """
+    categories, category_codes = np.unique(np.concatenate([columns["category"], columns["sketch_category"]]),
+                                           return_inverse=True)
+    products, first, product_codes = np.unique(columns["product"], return_index=True, return_inverse=True)
+    num_categories, num_products = len(categories), len(products)
+
+    cell_category = category_codes[:len(columns["category"])]
+    keys = (columns["date"].astype(np.int64) * num_categories + cell_category) * num_products + product_codes
+    cell_keys, cell_idx = group_keys(keys)
+
+    sketch_category = category_codes[len(columns["category"]):]
+    sketch_keys, sketch_registers = merge_sketches(
+        columns["sketch_date"].astype(np.int64) * num_categories + sketch_category, columns["sketch_registers"])
+
+    return {
+        "date": (cell_keys // (num_categories * num_products)).astype("datetime64[D]"),
+        "category": (cell_keys // num_products % num_categories).astype(np.int32),
+        "product": (cell_keys % num_products).astype(np.int32),
+        "amount": np.bincount(cell_idx, weights=columns["amount"], minlength=len(cell_keys)),
+        "count": np.bincount(cell_idx, weights=columns["count"], minlength=len(cell_keys)).astype(np.int64),
+        "categories": categories,
+        "products": products,
+        "descriptions": columns["description"][first],
+        "sketch_date": (sketch_keys // num_categories).astype("datetime64[D]"),
+        "sketch_category": (sketch_keys % num_categories).astype(np.int32),
+        "sketch_registers": sketch_registers,
+    }
+
+
+def decode(partition):
+    """
+    Cells and sketches of a partition with their categories and products as strings.
+    """
+    return {
+        "date": partition["date"],
+        "category": partition["categories"][partition["category"]],
+        "product": partition["products"][partition["product"]],
+        "description": partition["descriptions"][partition["product"]],
+        "amount": partition["amount"],
+        "count": partition["count"],
+        "sketch_date": partition["sketch_date"],
+        "sketch_category": partition["categories"][partition["sketch_category"]],
+        "sketch_registers": partition["sketch_registers"],
+    }
+
+
+def concatenate(decoded):
+    return {column: np.concatenate([columns[column] for columns in decoded]) for column in decoded[0]}
+
+
+def build_partition(dates, categories, products, descriptions, hashes, amounts, precision=CUBE_SKETCH_PRECISION):
+    """
+    Builds a cube partition from purchase records, with one customer sketch per (date, category).
+    """
+    categories = np.asarray(categories, dtype=str)
+    category_names, category_codes = np.unique(categories, return_inverse=True)
+    sketch_keys, groups = group_keys(dates.astype(np.int64) * len(category_names) + category_codes)
+    return aggregate({
+        "date": dates,
+        "category": categories,
+        "product": np.asarray(products, dtype=str),
+        "description": np.asarray(descriptions, dtype=str),
+        "amount": np.asarray(amounts, dtype=np.float64),
+        "count": np.ones(len(dates)),
+        "sketch_date": (sketch_keys // len(category_names)).astype("datetime64[D]"),
+        "sketch_category": category_names[sketch_keys % len(category_names)],
+        "sketch_registers": sketch(hashes, groups, len(sketch_keys), precision),
+    })
+
+
+def merge_partitions(partitions):
+    """
+    Merges partitions (e.g. an existing month and newly ingested purchases of the same month) into one.
+    Later partitions win for product descriptions.
+    """
+    return aggregate(concatenate([decode(partition) for partition in reversed(partitions)]))
+
+
+def partition_path(month):
+    return CUBE_PATH / f"{month}.npz"
+
+
+def save_partition(month, partition):
+    os.makedirs(CUBE_PATH, exist_ok=True)
+    # Write to a temporary file first so that readers never see a partial partition
+    temp_path = f"{partition_path(month)}.{os.getpid()}.tmp.npz"
+    np.savez(temp_path, **partition)
+    os.replace(temp_path, partition_path(month))
+
+
+def load_partition(month):
+    with np.load(partition_path(month)) as f:
+        return {key: f[key] for key in f.files}
+
+
+def load_manifest():
+    """
+    Loads the cube manifest (the months with a partition and the sketch precision), or returns None if the cube
+    has not been built.
+    """
+    if not os.path.exists(CUBE_MANIFEST_PATH):
+        return None
+    with open(CUBE_MANIFEST_PATH) as f:
+        return json.load(f)
+
+
+def save_manifest(manifest):
+    temp_path = f"{CUBE_MANIFEST_PATH}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_path, CUBE_MANIFEST_PATH)
+
+
+def cube_is_stale():
+    """
+    Whether the purchase log changed since the cube was last built or updated.
+    """
+    return is_stale(CUBE_MANIFEST_PATH, (DATASET_PATH,))
+
+
+def month_partitions(data, precision=CUBE_SKETCH_PRECISION):
+    """
+    Yields each month of the purchase records with its partition.
+    """
+    import pandas as pd
+    dates = pd.to_datetime(data['PurchaseDate']).to_numpy().astype("datetime64[D]")
+    hashes = customer_hashes(data['CustomerID'])
+    months = dates.astype("datetime64[M]")
+    columns = [data[column].to_numpy(dtype=str)
+               for column in ('ProductCategory', 'ProductID', 'ProductDescription')]
+    amounts = data['PurchaseAmount'].to_numpy(dtype=np.float64)
+    for month in np.unique(months):
+        mask = months == month
+        yield str(month), build_partition(dates[mask], *(column[mask] for column in columns), hashes[mask],
+                                          amounts[mask], precision)
+
+
+def build_cube(data, precision=CUBE_SKETCH_PRECISION):
+    """
+    Rebuilds every partition of the cube from the purchase log.
+    """
+    if os.path.exists(CUBE_PATH):
+        for name in os.listdir(CUBE_PATH):
+            if name.endswith(".npz"):
+                os.remove(CUBE_PATH / name)
+    manifest = {"sketch_precision": precision, "months": {}}
+    for month, partition in month_partitions(data, precision):
+        save_partition(month, partition)
+        manifest["months"][month] = {"cells": len(partition["date"]), "purchases": int(partition["count"].sum())}
+    os.makedirs(CUBE_PATH, exist_ok=True)
+    save_manifest(manifest)
+    return manifest
+
+
+def update_cube(new_data):
+    """
+    Merges newly appended purchase records into the partitions of their months.
+    Amounts and counts add up and sketches merge, so untouched months are not rewritten.
+    """
+    manifest = load_manifest()
+    for month, partition in month_partitions(new_data, manifest["sketch_precision"]):
+        if month in manifest["months"]:
+            partition = merge_partitions([load_partition(month), partition])
+        save_partition(month, partition)
+        manifest["months"][month] = {"cells": len(partition["date"]), "purchases": int(partition["count"].sum())}
+    save_manifest(manifest)
+    return manifest
+
+
+def load_window(manifest, date_from=None, date_to=None):
+    """
+    Reads only the partitions of the months overlapping [date_from, date_to] (both datetime64[D], None for open ends)
+    and returns their decoded cells and sketches within the window, or None if no partition overlaps it.
+    """
+    months = np.array(sorted(manifest["months"]), dtype="datetime64[M]")
+    if date_from is not None:
+        months = months[months >= date_from.astype("datetime64[M]")]
+    if date_to is not None:
+        months = months[months <= date_to.astype("datetime64[M]")]
+    if not len(months):
+        return None
+
+    window = concatenate([decode(load_partition(str(month))) for month in months])
+    cell_mask = np.ones(len(window["date"]), dtype=bool)
+    sketch_mask = np.ones(len(window["sketch_date"]), dtype=bool)
+    if date_from is not None:
+        cell_mask &= window["date"] >= date_from
+        sketch_mask &= window["sketch_date"] >= date_from
+    if date_to is not None:
+        cell_mask &= window["date"] <= date_to
+        sketch_mask &= window["sketch_date"] <= date_to
+    return {
+        **{column: window[column][cell_mask] for column in CELL_COLUMNS},
+        **{column: window[column][sketch_mask] for column in SKETCH_COLUMNS},
+    }
+
+
+def period_of(dates, granularity):
+    """
+    Start of the day, week (starting on Monday), month or year of each date, as a string label.
+    """
+    if granularity == "week":
+        # 1970-01-01 was a Thursday
+        dates = dates - ((dates.astype(np.int64) + 3) % 7).astype("timedelta64[D]")
+    elif granularity == "month":
+        dates = dates.astype("datetime64[M]")
+    elif granularity == "year":
+        dates = dates.astype("datetime64[Y]")
+    return dates.astype(str)
+
+
+def summarize(window, granularity):
+    """
+    Sales amount, sales count and distinct customers per period, per product description and per category.
+    Every table is a (labels, amounts, counts, customers) tuple; customers is None where no sketch applies.
+    """
+    periods = period_of(window["date"], granularity)
+    sketch_periods = period_of(window["sketch_date"], granularity)
+
+    def by(keys, sketch_keys=None):
+        labels, idx = group_keys(keys)
+        amounts = np.bincount(idx, weights=window["amount"], minlength=len(labels))
+        counts = np.bincount(idx, weights=window["count"], minlength=len(labels)).astype(np.int64)
+        customers = None
+        if sketch_keys is not None:
+            sketch_labels, registers = merge_sketches(sketch_keys, window["sketch_registers"])
+            customers = estimate(registers)[np.searchsorted(sketch_labels, labels)]
+        return labels, amounts, counts, customers
+
+    total_customers = float(estimate(window["sketch_registers"].max(axis=0))[0]) \
+        if len(window["sketch_registers"]) else 0.0
+    return {
+        "period": by(periods, sketch_periods),
+        "product": by(window["description"]),
+        "category": by(window["category"], window["sketch_category"]),
+        "total_amount": float(window["amount"].sum()),
+        "total_count": int(window["count"].sum()),
+        "total_customers": total_customers,
+    }
+
+
+def run(precision=CUBE_SKETCH_PRECISION):
+    import pandas as pd
+    try:
+        with profile_step("csv_load"):
+            data = pd.read_csv(DATASET_PATH)
+            add_rows(len(data))
+    except FileNotFoundError:
+        print("Dataset not found.")
+        return
+
+    with profile_step("cube_build"):
+        manifest = build_cube(data, precision)
+        add_rows(len(data))
+    cells = sum(month["cells"] for month in manifest["months"].values())
+    print(f"Sales cube of {cells} daily cells in {len(manifest['months'])} monthly partitions saved at {CUBE_PATH}")
+
+
+if __name__ == "__main__":
+    run()